@@ -0,0 +1,139 @@
+"""
+Compare database size and read latency of plain and compressed text columns.
+
+Two SQLite databases are filled with the same synthetic documents and chat
+messages, one storing TEXT as-is and one using CompressedText. Both also hold
+the full-text search index of the messages, as the application's database
+does; it stores message bodies uncompressed. Example:
+
+    python -m benchmarks.compression_bench --documents 200 --pages 30 --messages 5000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import Column, Integer, MetaData, Table, Text, create_engine, select
+from sqlalchemy.exc import OperationalError
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.synthetic_pdf import page_texts  # noqa: E402
+from src.utils.compression import COMPRESSION_CODEC, CompressedText  # noqa: E402
+from src.utils.search_index import FTS5_DDL, SEARCH_TABLE  # noqa: E402
+
+
+def build_tables(text_type):
+    metadata = MetaData()
+    documents = Table("documents", metadata, Column("id", Integer, primary_key=True), Column("extracted_text", text_type))
+    messages = Table("chat_messages", metadata, Column("id", Integer, primary_key=True), Column("content", text_type))
+    return metadata, documents, messages
+
+
+def run_variant(name, text_type, documents_data, messages_data, reads, rng_seed, workdir) -> dict:
+    path = os.path.join(workdir, f"{name}.db")
+    engine = create_engine(f"sqlite:///{path}")
+    metadata, documents, messages = build_tables(text_type)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(FTS5_DDL)
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(documents.insert(), [{"extracted_text": text} for text in documents_data])
+        conn.execute(messages.insert(), [{"content": text} for text in messages_data])
+        conn.exec_driver_sql(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, body, owner, kind, conversation_id, message_id) VALUES (?, ?, 'u1', 'message', 1, ?)",
+            [(2 * row_id, text, row_id) for row_id, text in enumerate(messages_data, start=1)],
+        )
+    write_seconds = time.perf_counter() - started
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+        try:
+            search_bytes = conn.exec_driver_sql(
+                f"SELECT sum(pgsize) FROM dbstat WHERE name LIKE '{SEARCH_TABLE}%'"
+            ).scalar()
+        except OperationalError:
+            # SQLite built without the dbstat table
+            search_bytes = None
+    engine.dispose()
+
+    # Reopen so reads are not served from the connection's page cache of the writes
+    engine = create_engine(f"sqlite:///{path}")
+    rng = random.Random(rng_seed)
+    timings = {}
+    for label, table, column_name, count in (
+        ("document", documents, "extracted_text", len(documents_data)),
+        ("message", messages, "content", len(messages_data)),
+    ):
+        ids = [rng.randint(1, count) for _ in range(reads)]
+        with engine.connect() as conn:
+            started = time.perf_counter()
+            for row_id in ids:
+                conn.execute(select(table.c[column_name]).where(table.c.id == row_id)).scalar_one()
+            timings[f"{label}_read_us"] = round(1e6 * (time.perf_counter() - started) / reads, 2)
+    engine.dispose()
+    return {
+        "db_bytes": os.path.getsize(path),
+        "search_bytes": search_bytes,
+        "write_s": round(write_seconds, 3),
+        **timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=30, help="Pages per synthetic document.")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=500, help="Random reads per table.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents_data = ["\n".join("\n".join(lines) for lines in page_texts(args.pages, seed)) for seed in range(args.documents)]
+    # Assistant replies are a few hundred to a few thousand characters
+    messages_data = [
+        " ".join(rng.choice(documents_data)[start:start + rng.randint(200, 3000)].split())
+        for start in (rng.randint(0, 5000) for _ in range(args.messages))
+    ]
+
+    workdir = tempfile.mkdtemp(prefix="cag-compression-")
+    result = {
+        "codec": COMPRESSION_CODEC,
+        "config": vars(args),
+        "plain": run_variant("plain", Text, documents_data, messages_data, args.reads, args.seed, workdir),
+        "compressed": run_variant("compressed", CompressedText, documents_data, messages_data, args.reads, args.seed, workdir),
+    }
+    plain, compressed = result["plain"], result["compressed"]
+    result["size_ratio"] = round(plain["db_bytes"] / compressed["db_bytes"], 2)
+    if plain["search_bytes"] is not None and compressed["search_bytes"] is not None:
+        result["size_ratio_without_search"] = round(
+            (plain["db_bytes"] - plain["search_bytes"]) / (compressed["db_bytes"] - compressed["search_bytes"]), 2
+        )
+
+    print(f"codec {COMPRESSION_CODEC}")
+    print(f"{'':<12}{'db MB':>10}{'search MB':>11}{'write s':>10}{'doc read us':>14}{'msg read us':>14}")
+    for name in ("plain", "compressed"):
+        stats = result[name]
+        search_mb = f"{stats['search_bytes'] / 1e6:.2f}" if stats["search_bytes"] is not None else "n/a"
+        print(
+            f"{name:<12}{stats['db_bytes'] / 1e6:>10.2f}{search_mb:>11}{stats['write_s']:>10}"
+            f"{stats['document_read_us']:>14}{stats['message_read_us']:>14}"
+        )
+    print(f"size ratio {result['size_ratio']}x")
+    if "size_ratio_without_search" in result:
+        print(f"size ratio without the search index {result['size_ratio_without_search']}x")
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
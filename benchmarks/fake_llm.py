@@ -0,0 +1,79 @@
+"""A deterministic stand-in for the Gemini client with configurable latency."""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+from benchmarks.synthetic_pdf import WORDS
+
+
+@dataclass
+class FakeLLMConfig:
+    first_chunk_latency: float = 0.3  # Seconds before the first chunk is streamed
+    chunk_interval: float = 0.05  # Seconds between subsequent chunks
+    chunks: int = 10  # Chunks per response
+    words_per_chunk: int = 8
+    capacity: int = 0  # Concurrent responses the backend serves, like a provider quota; 0 is unlimited
+
+
+class _FakeModels:
+    def __init__(self, config: FakeLLMConfig):
+        self.config = config
+        self._capacity = threading.BoundedSemaphore(config.capacity) if config.capacity else None
+
+    def _text(self, digest: bytes) -> str:
+        count = self.config.chunks * self.config.words_per_chunk
+        return " ".join(WORDS[digest[offset % len(digest)] % len(WORDS)] for offset in range(count))
+
+    def _json(self, prompt: str, schema: dict, digest: bytes) -> str:
+        """Produce a response matching the structured-output schemas used by ``llm_client``."""
+        properties = schema.get("properties", {})
+        if "answers" in properties:
+            questions = re.findall(r"^(\d+)\. ", prompt, flags=re.MULTILINE)
+            answers = [{"index": int(index), "answer": self._text(digest[int(index) % len(digest):])} for index in questions]
+            return json.dumps({"answers": answers})
+        return json.dumps({"answer": self._text(digest), "sources": []})
+
+    def generate_content_stream(self, model, contents, config=None):
+        prompt = "".join(part.text or "" for content in contents for part in content.parts)
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        if config is not None and config.response_mime_type == "application/json" and config.response_schema:
+            text = self._json(prompt, config.response_schema, digest)
+        else:
+            text = self._text(digest) + " "
+        step = -(-len(text) // self.config.chunks)
+        pieces = [text[start:start + step] for start in range(0, len(text), step)]
+        if self._capacity is not None:
+            self._capacity.acquire()
+        try:
+            time.sleep(self.config.first_chunk_latency)
+            for index, piece in enumerate(pieces):
+                if index:
+                    time.sleep(self.config.chunk_interval)
+                usage = None
+                if index == len(pieces) - 1:
+                    usage = SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+                yield SimpleNamespace(text=piece, usage_metadata=usage)
+        finally:
+            if self._capacity is not None:
+                self._capacity.release()
+
+
+class FakeClient:
+    """Mimics the subset of ``google.genai.Client`` used by ``src.utils.llm_client``."""
+
+    def __init__(self, config: FakeLLMConfig):
+        self.models = _FakeModels(config)
+
+
+def install(config: FakeLLMConfig):
+    """Route every ``llm_client`` call to a fake client using ``config``."""
+    from src.utils import llm_client
+
+    client = FakeClient(config)
+    llm_client._get_client = lambda api_key: client
+    return client
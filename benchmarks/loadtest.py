@@ -0,0 +1,369 @@
+"""
+In-process load test for the API against a fake LLM backend.
+
+The FastAPI app runs inside this process with a throwaway SQLite database and
+upload directory, so runs are self-contained and repeatable. Example:
+
+    python -m benchmarks.loadtest --concurrency 16 --requests 500 \
+        --mix upload=1,query=4,chat=3,list=2,summarize=1 --output results.json
+
+Compare two result files with ``python -m benchmarks.loadtest --compare a.json b.json``.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_MIX = "upload=1,query=4,chat=3,list=2,summarize=1"
+QUESTIONS = [
+    "What are the payment terms?",
+    "Summarize the termination clause.",
+    "Which parties are involved?",
+    "What does page 3 say about liability?",
+    "List all dates mentioned in the document.",
+]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, math.ceil(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / elapsed, 3) if elapsed else 0.0,
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(1000 * percentile(ordered, 0.50), 3),
+        "p95_ms": round(1000 * percentile(ordered, 0.95), 3),
+        "p99_ms": round(1000 * percentile(ordered, 0.99), 3),
+        "max_ms": round(1000 * ordered[-1], 3) if ordered else 0.0,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Workload:
+    """Shared state for the simulated clients: auth headers, documents and conversations."""
+
+    def __init__(self, client, pdfs: List[bytes], rng: random.Random):
+        self.client = client
+        self.pdfs = pdfs
+        self.rng = rng
+        self.headers = {}
+        self.documents: List[str] = []
+        self.conversations: List[str] = []
+
+    async def setup(self, documents: int):
+        credentials = {"username": f"bench-{uuid.uuid4().hex[:8]}", "password": "benchmark"}
+        await self.client.post("/api/v1/auth/register", json=credentials)
+        response = await self.client.post("/api/v1/auth/login", json=credentials)
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for _ in range(documents):
+            response = await upload(self)
+            response.raise_for_status()
+        for document_uuid in self.documents:
+            response = await self.client.post(
+                f"/api/v1/chat/start/{document_uuid}", json={"message": self.rng.choice(QUESTIONS)}, headers=self.headers
+            )
+            response.raise_for_status()
+            self.conversations.append(response.json()["uuid"])
+
+
+async def upload(workload: Workload):
+    document_uuid = str(uuid.uuid4())
+    response = await workload.client.post(
+        f"/api/v1/upload/{document_uuid}",
+        files={"file": ("bench.pdf", workload.rng.choice(workload.pdfs), "application/pdf")},
+        headers=workload.headers,
+    )
+    if response.status_code == 201:
+        workload.documents.append(document_uuid)
+    return response
+
+
+async def query(workload: Workload):
+    return await workload.client.get(
+        f"/api/v1/query/{workload.rng.choice(workload.documents)}",
+        params={"query": workload.rng.choice(QUESTIONS)},
+        headers=workload.headers,
+    )
+
+
+async def chat(workload: Workload):
+    return await workload.client.post(
+        f"/api/v1/chat/continue/{workload.rng.choice(workload.conversations)}",
+        json={"message": workload.rng.choice(QUESTIONS)},
+        headers=workload.headers,
+    )
+
+
+async def chat_start(workload: Workload):
+    return await workload.client.post(
+        f"/api/v1/chat/start/{workload.rng.choice(workload.documents)}",
+        json={"message": workload.rng.choice(QUESTIONS)},
+        headers=workload.headers,
+    )
+
+
+async def batch(workload: Workload):
+    return await workload.client.post(
+        f"/api/v1/query/{workload.rng.choice(workload.documents)}/batch",
+        json={"questions": [workload.rng.choice(QUESTIONS) for _ in range(10)]},
+        headers=workload.headers,
+    )
+
+
+async def multi(workload: Workload):
+    return await workload.client.post(
+        "/api/v1/query/multi", json={"query": workload.rng.choice(QUESTIONS)}, headers=workload.headers
+    )
+
+
+async def list_documents(workload: Workload):
+    return await workload.client.get("/api/v1/list_uuids", headers=workload.headers)
+
+
+async def summarize_document(workload: Workload):
+    return await workload.client.post(
+        f"/api/v1/summarize/{workload.rng.choice(workload.documents)}", headers=workload.headers
+    )
+
+
+OPERATIONS = {
+    "upload": upload,
+    "query": query,
+    "chat": chat,
+    "chat_start": chat_start,
+    "batch": batch,
+    "multi": multi,
+    "list": list_documents,
+    "summarize": summarize_document,
+}
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from benchmarks import fake_llm
+    from benchmarks.synthetic_pdf import generate_pdf
+
+    fake_llm.install(
+        fake_llm.FakeLLMConfig(
+            first_chunk_latency=args.llm_latency,
+            chunk_interval=args.llm_chunk_interval,
+            chunks=args.llm_chunks,
+            capacity=args.llm_capacity,
+        )
+    )
+    from loguru import logger
+
+    # Drop per-request console output
+    logger.remove(0)
+    import main
+    from src.db import init_db
+
+    init_db()
+
+    mix = parse_mix(args.mix)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    rng = random.Random(args.seed)
+    pdfs = [generate_pdf(args.pages, seed=args.seed + index) for index in range(args.pdf_variants)]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        workloads = [Workload(client, pdfs, rng) for _ in range(args.users)]
+        for workload in workloads:
+            await workload.setup(args.documents)
+        abuser = Workload(client, pdfs, rng)
+        if args.abusers:
+            await abuser.setup(1)
+
+        latencies: Dict[str, List[float]] = {name: [] for name in names}
+        errors: Dict[str, int] = {name: 0 for name in names}
+        abuse_latencies: List[float] = []
+        abuse_errors = abuse_rejected = 0
+        remaining = args.requests
+        deadline = time.perf_counter() + args.duration if args.duration else None
+        finished = False
+
+        async def abuser_loop():
+            # A single user hammering one operation without pause until the normal clients finish
+            nonlocal abuse_errors, abuse_rejected
+            while not finished:
+                started = time.perf_counter()
+                response = await OPERATIONS[args.abuse_op](abuser)
+                abuse_latencies.append(time.perf_counter() - started)
+                if response.status_code == 429:
+                    abuse_rejected += 1
+                    await asyncio.sleep(0.01)
+                elif response.status_code >= 400:
+                    abuse_errors += 1
+
+        async def client_loop(workload: Workload):
+            nonlocal remaining
+            while True:
+                if deadline is not None:
+                    if time.perf_counter() >= deadline:
+                        return
+                elif remaining <= 0:
+                    return
+                else:
+                    remaining -= 1
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await OPERATIONS[name](workload)
+                    failed = response.status_code >= 400
+                except Exception:
+                    failed = True
+                latencies[name].append(time.perf_counter() - started)
+                if failed:
+                    errors[name] += 1
+
+        async def normal_clients():
+            nonlocal finished
+            await asyncio.gather(*(client_loop(workloads[index % args.users]) for index in range(args.concurrency)))
+            finished = True
+
+        started = time.perf_counter()
+        await asyncio.gather(normal_clients(), *(abuser_loop() for _ in range(args.abusers)))
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [sample for samples in latencies.values() for sample in samples]
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(UTC).isoformat(),
+            "python": sys.version.split()[0],
+            "config": {
+                key: value for key, value in vars(args).items() if key not in ("output", "compare")
+            },
+        },
+        "elapsed_s": round(elapsed, 3),
+        "total": summarize(all_latencies, sum(errors.values()), elapsed),
+        "endpoints": {name: summarize(latencies[name], errors[name], elapsed) for name in names},
+    }
+    if args.abusers:
+        result["abuse"] = dict(summarize(abuse_latencies, abuse_errors, elapsed), rejected=abuse_rejected)
+    return result
+
+
+def print_report(result: dict):
+    print(f"commit {result['meta']['commit']}  elapsed {result['elapsed_s']}s")
+    header = f"{'endpoint':<12}{'reqs':>7}{'errs':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    rows = list(result["endpoints"].items()) + [("TOTAL", result["total"])]
+    for name, stats in rows:
+        print(
+            f"{name:<12}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>9}"
+            f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+        )
+    if "abuse" in result:
+        stats = result["abuse"]
+        print(
+            f"{'abuser':<12}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>9}"
+            f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}  ({stats['rejected']} rejected with 429)"
+        )
+
+
+def compare(baseline_path: str, candidate_path: str):
+    baseline = json.loads(Path(baseline_path).read_text())
+    candidate = json.loads(Path(candidate_path).read_text())
+    print(f"{baseline['meta']['commit']} -> {candidate['meta']['commit']}")
+    print(f"{'endpoint':<12}{'rps':>16}{'p50 ms':>20}{'p95 ms':>20}{'p99 ms':>20}")
+    names = list(dict.fromkeys(list(baseline["endpoints"]) + list(candidate["endpoints"]))) + ["TOTAL"]
+    for name in names:
+        before = baseline["total"] if name == "TOTAL" else baseline["endpoints"].get(name)
+        after = candidate["total"] if name == "TOTAL" else candidate["endpoints"].get(name)
+        if not before or not after:
+            continue
+        cells = [f"{before[key]}->{after[key]}" for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")]
+        print(f"{name:<12}{cells[0]:>16}{cells[1]:>20}{cells[2]:>20}{cells[3]:>20}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8, help="Simulated concurrent clients.")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests (ignored with --duration).")
+    parser.add_argument("--duration", type=float, default=0, help="Run for this many seconds instead.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted operations, default {DEFAULT_MIX}.")
+    parser.add_argument("--documents", type=int, default=5, help="Documents uploaded before the run.")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per synthetic PDF.")
+    parser.add_argument("--pdf-variants", type=int, default=3, help="Distinct synthetic PDFs to upload.")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake LLM time to first chunk, seconds.")
+    parser.add_argument("--llm-chunk-interval", type=float, default=0.05, help="Fake LLM delay between chunks.")
+    parser.add_argument("--llm-chunks", type=int, default=10, help="Chunks per fake LLM response.")
+    parser.add_argument(
+        "--llm-capacity", type=int, default=0, help="Concurrent responses the fake LLM serves, 0 for unlimited."
+    )
+    parser.add_argument("--users", type=int, default=1, help="Normal users the clients are spread across.")
+    parser.add_argument("--abusers", type=int, default=0, help="Clients of one extra user sending requests without pause.")
+    parser.add_argument("--abuse-op", default="summarize", choices=sorted(OPERATIONS), help="Operation sent by the abusers.")
+    parser.add_argument(
+        "--llm-user-rate", type=float, default=0, help="Per-user LLM calls per minute, 0 disables rate limiting."
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    output = Path(args.output).resolve() if args.output else None
+    # Isolate the database, uploads and logs of the run from the working tree
+    workdir = tempfile.mkdtemp(prefix="cag-bench-")
+    os.environ["MYSQL_DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["GEMINI_API_KEY"] = "benchmark-fake-key"
+    os.environ["LLM_USER_RATE_PER_MINUTE"] = str(args.llm_user_rate)
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_ROOT))
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if output:
+        output.write_text(json.dumps(result, indent=2))
+        print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
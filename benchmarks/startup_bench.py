@@ -0,0 +1,131 @@
+"""
+Measure worker cold start: import time, application start-up and time to first request.
+
+Every run starts a fresh Python process, as a newly scaled-up worker would.
+"fresh" runs start against an empty SQLite database and create the schema,
+"migrated" runs reuse a database whose schema is already up to date. Example:
+
+    python -m benchmarks.startup_bench --runs 10 --importtime 15 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.loadtest import git_commit
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+CHILD = """
+import json, sys, time
+started = time.time()
+sys.path.insert(0, {repo!r})
+import main
+imported = time.time()
+from fastapi.testclient import TestClient
+client_ready = time.time()
+with TestClient(main.app) as client:
+    app_ready = time.time()
+    status = client.get("/").status_code
+    first_response = time.time()
+print(json.dumps({{
+    "started": started,
+    "imported": imported,
+    "client_import_s": client_ready - imported,
+    "startup_s": app_ready - client_ready,
+    "first_response": first_response,
+    "status": status,
+}}))
+"""
+
+
+def run_once(workdir: str, database: str, importtime: bool = False) -> dict:
+    env = dict(
+        os.environ,
+        MYSQL_DATABASE_URL=f"sqlite:///{database}",
+        GEMINI_API_KEY="benchmark-fake-key",
+    )
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", CHILD.format(repo=str(REPO_ROOT))]
+    spawned = time.time()
+    completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {
+        "interpreter_s": timings["started"] - spawned,
+        "import_s": timings["imported"] - timings["started"],
+        "startup_s": timings["startup_s"],
+        # From process spawn to the first response, excluding the test client import
+        "first_request_s": timings["first_response"] - spawned - timings["client_import_s"],
+        "status": timings["status"],
+        "importtime": completed.stderr if importtime else None,
+    }
+
+
+def slowest_imports(report: str, limit: int) -> list:
+    """Parse ``-X importtime`` output into the modules with the largest cumulative time."""
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": cumulative / 1000, "self_ms": own / 1000} for cumulative, own, name in rows[:limit]]
+
+
+def summarize(runs: list) -> dict:
+    summary = {"runs": len(runs)}
+    for key in ("interpreter_s", "import_s", "startup_s", "first_request_s"):
+        values = [run[key] for run in runs]
+        summary[key.replace("_s", "_ms")] = {
+            "median": round(1000 * statistics.median(values), 1),
+            "min": round(1000 * min(values), 1),
+            "max": round(1000 * max(values), 1),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Processes started per scenario.")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="Also list the N slowest imports.")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="cag-startup-")
+    scenarios = {"fresh": [], "migrated": []}
+    for index in range(args.runs):
+        database = os.path.join(workdir, f"fresh-{index}.db")
+        scenarios["fresh"].append(run_once(workdir, database))
+        scenarios["migrated"].append(run_once(workdir, database))
+
+    result = {
+        "meta": {"commit": git_commit(), "python": sys.version.split()[0]},
+        "scenarios": {name: summarize(runs) for name, runs in scenarios.items()},
+    }
+    if args.importtime:
+        report = run_once(workdir, os.path.join(workdir, "importtime.db"), importtime=True)["importtime"]
+        result["slowest_imports"] = slowest_imports(report, args.importtime)
+
+    print(f"commit {result['meta']['commit']}  python {result['meta']['python']}")
+    for name, summary in result["scenarios"].items():
+        print(f"{name:>9}  " + "  ".join(
+            f"{key[:-3]} {values['median']}ms" for key, values in summary.items() if key != "runs"
+        ))
+    for row in result.get("slowest_imports", []):
+        print(f"{row['cumulative_ms']:>9.1f}ms  {row['module']}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
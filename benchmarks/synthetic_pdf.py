@@ -0,0 +1,73 @@
+"""Generate synthetic, text-extractable PDF documents without third-party dependencies."""
+
+import random
+from typing import List
+
+WORDS = (
+    "agreement party contract clause payment term notice liability warranty "
+    "delivery invoice schedule obligation termination renewal confidential "
+    "service period fee amendment dispute jurisdiction effective date section "
+    "report revenue growth quarter analysis result method sample figure table"
+).split()
+
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def page_texts(pages: int, seed: int = 0) -> List[List[str]]:
+    """Return deterministic pseudo-random lines of text for every page."""
+    rng = random.Random(seed)
+    return [
+        [f"Page {number} " + " ".join(rng.choice(WORDS) for _ in range(WORDS_PER_LINE))]
+        + [" ".join(rng.choice(WORDS) for _ in range(WORDS_PER_LINE)) for _ in range(LINES_PER_PAGE - 1)]
+        for number in range(1, pages + 1)
+    ]
+
+
+def build_pdf(pages: List[List[str]]) -> bytes:
+    """
+    Build a minimal PDF with one Helvetica text block per page.
+
+    Args:
+        pages (List[List[str]]): The lines of text for every page.
+
+    Returns:
+        bytes: The PDF file content.
+    """
+    count = len(pages)
+    font_ref = 3 + 2 * count
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{3 + 2 * index} 0 R" for index in range(count)), count
+        ),
+    ]
+    for index, lines in enumerate(pages):
+        stream = "BT /F1 10 Tf 14 TL 50 760 Td " + " ".join(f"({_escape(line)}) ' " for line in lines) + "ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * index} 0 R "
+            f"/Resources << /Font << /F1 {font_ref} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(output)
+
+
+def generate_pdf(pages: int, seed: int = 0) -> bytes:
+    """Generate a synthetic PDF with ``pages`` pages of deterministic text."""
+    return build_pdf(page_texts(pages, seed))
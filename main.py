@@ -1,15 +1,44 @@
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from src.routers import data_handler
 from fastapi.responses import HTMLResponse
 from src.db import init_db
 from src.routers import auth
 from loguru import logger
 from fastapi.middleware.cors import CORSMiddleware
+from src.utils.metrics import (
+    HTTP_REQUEST_DURATION,
+    DB_QUERIES_PER_REQUEST,
+    DB_TIME_PER_REQUEST,
+    start_request_db_stats,
+    route_template,
+    render_metrics,
+)
+from src.utils import profiling
+from src.utils.maintenance import start_maintenance_worker
+from src.utils.request_logging import REQUEST_ID_HEADER, configure_logging, start_request_context, log_request_completed
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up logging, the database schema and the maintenance worker when a worker starts."""
+    log_handlers = configure_logging()
+    await run_in_threadpool(init_db)
+    maintenance_worker = start_maintenance_worker()
+    logger.info("Starting CAG Project API application.")
+    yield
+    if maintenance_worker is not None:
+        await run_in_threadpool(maintenance_worker.stop)
+    # Flush the enqueued records before the worker exits
+    for handler in log_handlers:
+        logger.remove(handler)
 
 app = FastAPI(
     title="CAG Project Api Chatwith Your PDF ",
     description="API for uploading PDFs, querying content through LLMs, and managing data.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -20,6 +49,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record latency and SQL usage per route template, and log a summary of the request."""
+    db_stats = start_request_db_stats()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        route_path = route_template(request.scope)
+        HTTP_REQUEST_DURATION.labels(
+            method=request.method, route=route_path, status=str(status_code)
+        ).observe(elapsed)
+        DB_QUERIES_PER_REQUEST.labels(route=route_path).observe(db_stats.queries)
+        DB_TIME_PER_REQUEST.labels(route=route_path).observe(db_stats.seconds)
+        log_request_completed(status_code, elapsed, db_stats.queries, db_stats.seconds)
+
+async def profile_request(request: Request, call_next):
+    """Capture a stack-sampled profile for admin-requested or randomly sampled requests."""
+    admin = profiling.is_admin_request(request.headers)
+    if not admin and not profiling.is_sampled():
+        return await call_next(request)
+    profile = profiling.start_profile(request.method)
+    try:
+        response = await call_next(request)
+    finally:
+        profile.stop()
+        profile.name = profiling.profile_name(request.method, route_template(request.scope))
+        path = await run_in_threadpool(profile.save)
+        breakdown = ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in profile.breakdown().items())
+        logger.info(f"Saved profile {path} ({breakdown})")
+    # Only admins learn where profiles are stored on the server
+    if admin:
+        response.headers["X-Profile-Path"] = path
+    return response
+
+if profiling.PROFILING_ENABLED:
+    app.middleware("http")(profile_request)
+
+@app.middleware("http")
+async def bind_request_context(request: Request, call_next):
+    """Give every log record of a request its request ID, route and user."""
+    context = start_request_context(request.scope, request.headers.get(REQUEST_ID_HEADER))
+    response = await call_next(request)
+    response.headers[REQUEST_ID_HEADER] = context["request_id"]
+    return response
+
 app.include_router(
     data_handler.router,
     prefix="/api/v1",
@@ -28,10 +107,12 @@ app.include_router(
 
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
 
-init_db()
 
-logger.add("logs/app.log", rotation="1 week", retention="4 weeks", level="INFO")
-logger.info("Starting CAG Project API application.")
+@app.get("/metrics", tags=["Monitoring"], include_in_schema=False)
+def metrics():
+    """Expose Prometheus metrics."""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
 
 
 @app.get("/", response_class=HTMLResponse, tags=["Root"])
@@ -0,0 +1,5 @@
+from src.env import load_environment
+
+# Modules read their configuration from os.environ at import time, so the .env
+# file has to be loaded before any of them
+load_environment()
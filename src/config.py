@@ -0,0 +1,11 @@
+import os
+
+# Uploaded PDFs are stored here, named after their document's UUID
+UPLOAD_DIR = "./uploads"
+# Limits on every stored PDF, whether uploaded or imported
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
+MAX_PDF_PAGES = 100
+# Decompressed size of an import. A document line carries its PDF in base64
+# next to its extracted text, so lines may be a few times MAX_FILE_SIZE.
+MAX_IMPORT_BYTES = int(os.environ.get("MAX_IMPORT_BYTES", str(2 * 1024 ** 3)))
+MAX_IMPORT_LINE_BYTES = 4 * MAX_FILE_SIZE
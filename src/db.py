@@ -1,10 +1,11 @@
+import hashlib
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import Column, MetaData, String, Table, create_engine, inspect, select, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker
 from src.models import Base
-from dotenv import load_dotenv, find_dotenv
-
-load_dotenv(find_dotenv())
+from src.utils import metrics, profiling
+from src.utils.search_index import FTS5_COLUMNS, SEARCH_TABLE, init_search_index, mysql_search_table
 
 SQLALCHEMY_DATABASE_URL = os.environ.get("MYSQL_DATABASE_URL")
 if not SQLALCHEMY_DATABASE_URL:
@@ -13,7 +14,55 @@ if not SQLALCHEMY_DATABASE_URL:
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
 )
+metrics.instrument_engine(engine)
+profiling.instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def add_missing_columns():
+    """Add nullable columns that were introduced after a table was first created."""
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}"
+                    ))
+
+# Fingerprint of the schema the database was last migrated to, so that worker
+# start-up can skip reflection and DDL when nothing changed
+schema_metadata = MetaData()
+schema_state = Table("schema_state", schema_metadata, Column("fingerprint", String(64), primary_key=True))
+
+def schema_fingerprint() -> str:
+    """Hash of every declared table and column, plus the search index table."""
+    parts = [
+        f"{table.name}.{column.name} {column.type.compile(dialect=engine.dialect)} {column.nullable}"
+        for table in Base.metadata.sorted_tables
+        for column in table.columns
+    ]
+    parts.append(f"search {SEARCH_TABLE} {FTS5_COLUMNS} {', '.join(mysql_search_table.columns.keys())}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+def is_migrated() -> bool:
+    """Check with a single query whether the database already matches the models."""
+    try:
+        with engine.connect() as conn:
+            stored = conn.execute(select(schema_state.c.fingerprint)).scalar()
+    except DBAPIError:
+        return False
+    return stored == schema_fingerprint()
+
 def init_db():
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    if is_migrated():
+        return
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    init_search_index(engine)
+    schema_metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(schema_state.delete())
+        conn.execute(schema_state.insert().values(fingerprint=schema_fingerprint()))
@@ -0,0 +1,18 @@
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# The project's .env file sits next to main.py. Loading it from a fixed path
+# avoids find_dotenv() walking the directory tree on every worker start.
+DOTENV_PATH = os.environ.get("DOTENV_PATH") or str(Path(__file__).resolve().parent.parent / ".env")
+
+_loaded = False
+
+
+def load_environment():
+    """Load the .env file once. Variables already set in the environment win."""
+    global _loaded
+    if not _loaded:
+        load_dotenv(DOTENV_PATH)
+        _loaded = True
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, LargeBinary
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime, UTC
+from src.utils.compression import CompressedText
 
 Base = declarative_base()
 
@@ -19,10 +20,12 @@ class Document(Base):
     uuid = Column(String(36), unique=True, index=True, nullable=False)
     filename = Column(String(255), nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    extracted_text = Column(Text, nullable=False)
+    extracted_text = Column(CompressedText, nullable=False)
+    page_offsets = Column(LargeBinary, nullable=True)  # Page start offsets into extracted_text, see utils.page_index
     upload_date = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
     file_path = Column(String(512), nullable=False)
-    summary = Column(Text, nullable=True)  # Auto-generated summary
+    file_sha256 = Column(String(64), nullable=True)  # Hex digest of the stored PDF, used as its ETag
+    summary = Column(CompressedText, nullable=True)  # Auto-generated summary
     summary_generated_at = Column(DateTime(timezone=True), nullable=True)
     owner = relationship('User', back_populates='documents')
     conversations = relationship('Conversation', back_populates='document')
@@ -37,6 +40,7 @@ class Conversation(Base):
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
     updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
     is_active = Column(Boolean, default=True)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # Set when soft-deleted, starts the retention period
     user = relationship('User', back_populates='conversations')
     document = relationship('Document', back_populates='conversations')
     messages = relationship('ChatMessage', back_populates='conversation')
@@ -46,6 +50,7 @@ class ChatMessage(Base):
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False)
     role = Column(String(50), nullable=False)  # 'user' or 'assistant'
-    content = Column(Text, nullable=False)
+    content = Column(CompressedText, nullable=False)
+    model = Column(String(100), nullable=True)  # LLM that generated an assistant message
     timestamp = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
     conversation = relationship('Conversation', back_populates='messages')
@@ -3,9 +3,10 @@ from sqlalchemy.orm import Session
 from src.db import SessionLocal
 from src.models import User
 from src.utils.auth import hash_password, verify_password, create_access_token
+from src.utils.profiling import ProfiledRoute
 from pydantic import BaseModel
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 def get_db():
     db = SessionLocal()
@@ -1,38 +1,60 @@
-from fastapi import APIRouter, UploadFile, HTTPException, Query, File, Depends, status
+from fastapi import APIRouter, UploadFile, HTTPException, Query, File, Depends, status, BackgroundTasks, Request, Response
 import uuid as uuid_pkg
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
 from sqlalchemy.orm import Session
+from src.config import MAX_FILE_SIZE, MAX_IMPORT_BYTES, MAX_PDF_PAGES, UPLOAD_DIR
 from src.db import SessionLocal
 from src.models import Document, User, Conversation, ChatMessage
-from src.utils.pdf_processor import extract_text_from_pdf
-from src.utils.llm_client import get_llm_response, get_chat_response, generate_document_summary, generate_conversation_title
+from src.utils.pdf_processor import extract_pages_from_pdf, record_page_timings
+from src.utils.page_index import join_pages, append_pages, get_pages, format_pages, page_count, parse_page_range
+from src.utils.llm_client import get_llm_response, get_chat_response, generate_document_summary, generate_conversation_title, quick_conversation_title, get_multi_document_response, get_batch_llm_response
+from src.utils.search_index import index_messages, index_title, remove_conversations, search
+from src.utils.retrieval import PASSAGE_CHARS, split_passages, query_terms, count_terms, rank_passages, merge_passages, format_passages
+from src.utils.http_cache import PRIVATE_CACHE_CONTROL, content_sha256, file_sha256, strong_etag, http_date, is_not_modified
 from src.utils.auth import decode_access_token
+from src.utils.profiling import ProfiledRoute, profiled
+from src.utils.request_logging import set_request_user
+from src.utils.admission import BULK, INTERACTIVE, LLM_MAX_CONCURRENCY, AdmissionRejected, admitted_batch, llm_caller
+from src.utils.pdf_processor import pypdf
+from src.utils.data_transfer import GZIP_MEDIA_TYPE, NDJSON_MEDIA_TYPE, ImportFormatError, export_user_data, import_user_data
+from src.utils.bulk_ingest import IngestError, copy_limited, discard, extract_member, is_zip, submit_extraction, zip_members
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import FileResponse
-from pypdf import PdfReader
+from fastapi.responses import FileResponse, StreamingResponse
 import re
 from loguru import logger
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime, UTC
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
-UPLOAD_DIR = "./uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
-MAX_PDF_PAGES = 100
 UUID_REGEX = re.compile(r"^[a-fA-F0-9\-]{36}$")
+MAX_MULTI_QUERY_DOCUMENTS = 50
+MULTI_QUERY_CONTEXT_CHARS = 60_000  # Shared context budget across all documents of a multi-document query
+MULTI_QUERY_PASSAGES_PER_DOCUMENT = 8
+MAX_BATCH_QUESTIONS = 100
+MAX_BULK_FILES = 500  # PDFs per bulk upload, counting those inside ZIP archives
+BULK_COMMIT_BATCH = 50  # Documents inserted per transaction during a bulk upload
+
+# Pool running the LLM calls of batch query groups. Admitted batches never run
+# more than LLM_MAX_CONCURRENCY groups at once, so they never wait for a thread.
+batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("BATCH_WORKERS", str(LLM_MAX_CONCURRENCY))), thread_name_prefix="batch")
 
 # Pydantic models for request/response
 class ChatMessageRequest(BaseModel):
     message: str
+    pages: Optional[str] = None  # Restrict the document context to a page range, e.g. "3-7"
 
 class ChatMessageResponse(BaseModel):
     role: str
     content: str
     timestamp: datetime
+    model: Optional[str] = None  # The model that wrote an assistant message
 
 class ConversationResponse(BaseModel):
     uuid: str
@@ -41,6 +63,17 @@ class ConversationResponse(BaseModel):
     updated_at: datetime
     messages: List[ChatMessageResponse]
 
+class MultiDocumentQueryRequest(BaseModel):
+    query: str = Field(..., min_length=1, max_length=1000)
+    document_uuids: Optional[List[uuid_pkg.UUID]] = None  # None queries all documents of the user
+    # At least one passage, so that every request has some context
+    max_context_chars: int = Field(MULTI_QUERY_CONTEXT_CHARS, ge=PASSAGE_CHARS, le=200_000)
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUESTIONS)
+    pages: Optional[str] = None  # Restrict the document context to a page range, e.g. "3-7"
+    questions_per_call: int = Field(5, ge=1, le=20)  # Questions packed into one LLM prompt
+
 class DocumentSummaryResponse(BaseModel):
     uuid: str
     filename: str
@@ -56,6 +89,7 @@ def get_db():
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+@profiled("get_current_user")
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -68,12 +102,37 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     user = db.query(User).filter_by(id=payload["user_id"]).first()
     if not user:
         raise credentials_exception
+    set_request_user(user.id)
     return user
 
 def validate_uuid(uuid_str):
     if not UUID_REGEX.match(uuid_str):
         raise HTTPException(status_code=400, detail="Invalid UUID format.")
 
+def require_page_index(doc: Document):
+    if not doc.page_offsets:
+        raise HTTPException(
+            status_code=409,
+            detail="Page index not available for this document. Upload it again to enable page ranges.",
+        )
+
+@profiled("prompt: document context")
+def get_document_context(doc: Document, pages: Optional[str] = None) -> str:
+    """Build the LLM context for a document, optionally restricted to a page range."""
+    if pages is None:
+        if not doc.page_offsets:
+            return doc.extracted_text
+        return format_pages(get_pages(doc.extracted_text, doc.page_offsets, 1, page_count(doc.page_offsets)))
+    require_page_index(doc)
+    try:
+        first, last = parse_page_range(pages)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total_pages = page_count(doc.page_offsets)
+    if first > total_pages:
+        raise HTTPException(status_code=400, detail=f"Page {first} out of range. Document has {total_pages} pages.")
+    return format_pages(get_pages(doc.extracted_text, doc.page_offsets, first, last or total_pages))
+
 @router.post("/upload/{uuid}", status_code=201)
 def upload_pdf(uuid: uuid_pkg.UUID, file: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     uuid_str = str(uuid)
@@ -95,7 +154,7 @@ def upload_pdf(uuid: uuid_pkg.UUID, file: UploadFile = File(...), db: Session =
         os.remove(file_path)
         raise HTTPException(status_code=400, detail="Uploaded file is empty.")
     try:
-        reader = PdfReader(file_path)
+        reader = pypdf.PdfReader(file_path)
         if len(reader.pages) > MAX_PDF_PAGES:
             os.remove(file_path)
             raise HTTPException(status_code=400, detail=f"PDF too long. Max {MAX_PDF_PAGES} pages allowed.")
@@ -109,8 +168,8 @@ def upload_pdf(uuid: uuid_pkg.UUID, file: UploadFile = File(...), db: Session =
             detail=f"UUID {uuid_str} already exists. Use PUT to update the PDF.",
         )
     try:
-        extracted_text = extract_text_from_pdf(file_path)
-        if not extracted_text:
+        extracted_text, page_offsets = join_pages(extract_pages_from_pdf(file_path))
+        if not extracted_text.strip():
             raise HTTPException(
                 status_code=500, detail="Error extracting text from PDF."
             )
@@ -119,7 +178,9 @@ def upload_pdf(uuid: uuid_pkg.UUID, file: UploadFile = File(...), db: Session =
             filename=file.filename,
             user_id=current_user.id,
             extracted_text=extracted_text,
-            file_path=file_path
+            page_offsets=page_offsets,
+            file_path=file_path,
+            file_sha256=content_sha256(content),
         )
         db.add(doc)
         db.commit()
@@ -153,7 +214,7 @@ def update_pdf_data(uuid: uuid_pkg.UUID, file: UploadFile = File(...), db: Sessi
             raise HTTPException(status_code=400, detail=f"File too large. Max size is {MAX_FILE_SIZE // (1024*1024)}MB.")
         buffer.write(content)
     try:
-        reader = PdfReader(file_path)
+        reader = pypdf.PdfReader(file_path)
         if len(reader.pages) > MAX_PDF_PAGES:
             os.remove(file_path)
             raise HTTPException(status_code=400, detail=f"PDF too long. Max {MAX_PDF_PAGES} pages allowed.")
@@ -168,28 +229,176 @@ def update_pdf_data(uuid: uuid_pkg.UUID, file: UploadFile = File(...), db: Sessi
             status_code=404,
             detail=f"UUID {uuid_str} not found. Use POST to upload the PDF.",
         )
-    new_text = extract_text_from_pdf(file_path)
-    if not new_text:
+    new_pages = extract_pages_from_pdf(file_path)
+    if not any(page_text.strip() for page_text in new_pages):
         logger.error(f"Update failed: Text extraction failed for user {current_user.username}, file {file.filename}")
         raise HTTPException(
             status_code=500, detail="Error extracting text from PDF."
         )
-    doc.extracted_text += "\n\n" + new_text
+    if doc.page_offsets:
+        doc.extracted_text, doc.page_offsets = append_pages(doc.extracted_text, doc.page_offsets, new_pages)
+    else:
+        doc.extracted_text += "\n\n" + "\n".join(page_text for page_text in new_pages if page_text)
+    previous_file_path = doc.file_path
     doc.filename = file.filename
     doc.file_path = file_path
+    doc.file_sha256 = content_sha256(content)
     db.commit()
+    if previous_file_path != file_path and os.path.exists(previous_file_path):
+        os.remove(previous_file_path)
     logger.info(f"User {current_user.username} updated PDF {file.filename} with UUID {uuid_str}")
     return {
         "message": f"PDF {file.filename} updated and text extracted successfully.",
         "uuid": uuid_str,
     }
 
+def commit_documents(db: Session, batch: List[tuple]) -> int:
+    """Insert a batch of bulk-uploaded documents in one transaction, recording the outcome in their manifest entries."""
+    if not batch:
+        return 0
+    try:
+        db.add_all([doc for _, doc in batch])
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception(f"Bulk upload: inserting {len(batch)} documents failed")
+        for entry, doc in batch:
+            discard(doc.file_path)
+            entry.update(uuid=None, status="failed", detail="An error occurred while saving the document.")
+        return 0
+    # Detached so the extracted text of earlier batches can be freed
+    for entry, doc in batch:
+        entry["status"] = "created"
+        db.expunge(doc)
+    return len(batch)
+
+@router.post("/bulk/upload", status_code=200)
+def bulk_upload_pdfs(files: List[UploadFile] = File(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Upload many PDFs at once, as separate files and/or ZIP archives of PDFs.
+
+    Every PDF gets a new UUID. Files are written to disk in chunks, validated and
+    extracted in parallel by the ingest worker processes and inserted in batches.
+    A file that fails does not fail the request: the response lists the outcome
+    of every file, with ``status`` "created", "rejected" (invalid file) or "failed".
+    """
+    manifest: List[dict] = []
+    staged: List[tuple] = []
+
+    def add_entry(filename: str, archive: Optional[str] = None) -> dict:
+        entry = {"filename": filename, "archive": archive, "uuid": None, "status": "rejected", "detail": None}
+        manifest.append(entry)
+        return entry
+
+    def stage(entry: dict, copy):
+        if len(staged) >= MAX_BULK_FILES:
+            entry["detail"] = f"Too many files. Max {MAX_BULK_FILES} PDFs per request."
+            return
+        uuid_str = str(uuid_pkg.uuid4())
+        file_path = os.path.join(UPLOAD_DIR, f"{uuid_str}_{entry['filename']}")
+        try:
+            sha256 = copy(file_path)
+        except IngestError as e:
+            entry["detail"] = str(e)
+            return
+        entry["uuid"] = uuid_str
+        staged.append((entry, file_path, sha256))
+
+    for upload in files:
+        filename = os.path.basename(upload.filename or "") or "upload.pdf"
+        if is_zip(filename, upload.content_type):
+            # Starlette spools large uploads to a temporary file, so members are read from disk
+            try:
+                for name, info, zip_file in zip_members(upload.file):
+                    entry = add_entry(name, archive=filename)
+                    if not name.lower().endswith(".pdf"):
+                        entry["detail"] = "Not a PDF file."
+                        continue
+                    stage(entry, lambda path: extract_member(zip_file, info, path, MAX_FILE_SIZE))
+            except IngestError as e:
+                add_entry(filename)["detail"] = str(e)
+        elif upload.content_type == "application/pdf" or filename.lower().endswith(".pdf"):
+            stage(add_entry(filename), lambda path: copy_limited(upload.file, path, MAX_FILE_SIZE))
+        else:
+            add_entry(filename)["detail"] = "Invalid file type. Please upload PDF files or ZIP archives."
+
+    futures = {submit_extraction(file_path, MAX_PDF_PAGES): (entry, file_path, sha256) for entry, file_path, sha256 in staged}
+    created = 0
+    batch = []
+    for future in as_completed(futures):
+        entry, file_path, sha256 = futures[future]
+        try:
+            extracted_text, page_offsets, page_seconds = future.result()
+        except IngestError as e:
+            discard(file_path)
+            entry.update(uuid=None, detail=str(e))
+            continue
+        except Exception:
+            logger.exception(f"Bulk upload: processing {entry['filename']} failed for user {current_user.username}")
+            discard(file_path)
+            entry.update(uuid=None, status="failed", detail="An error occurred during file processing.")
+            continue
+        record_page_timings(page_seconds)
+        batch.append((entry, Document(
+            uuid=entry["uuid"],
+            filename=entry["filename"],
+            user_id=current_user.id,
+            extracted_text=extracted_text,
+            page_offsets=page_offsets,
+            file_path=file_path,
+            file_sha256=sha256,
+        )))
+        if len(batch) >= BULK_COMMIT_BATCH:
+            created += commit_documents(db, batch)
+            batch = []
+    created += commit_documents(db, batch)
+
+    failed = sum(entry["status"] == "failed" for entry in manifest)
+    logger.info(f"User {current_user.username} bulk uploaded {created} of {len(manifest)} files")
+    return {
+        "created": created,
+        "rejected": len(manifest) - created - failed,
+        "failed": failed,
+        "files": manifest,
+    }
+
+@router.get("/export", response_class=StreamingResponse)
+def export_data(
+    compress: bool = Query(False, description="Gzip the export."),
+    current_user: User = Depends(get_current_user)
+):
+    """Stream all documents (with their PDF files), active conversations and messages of the current user as NDJSON."""
+    filename = f"cag-export-{datetime.now(UTC):%Y%m%d}.ndjson" + (".gz" if compress else "")
+    logger.info(f"User {current_user.username} started an export")
+    return StreamingResponse(
+        export_user_data(current_user.id, compress),
+        media_type=GZIP_MEDIA_TYPE if compress else NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.post("/import", status_code=200)
+def import_data(file: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Import an export, plain or gzipped, into the current user's account."""
+    if file.size is not None and file.size > MAX_IMPORT_BYTES:
+        raise HTTPException(status_code=400, detail=f"File too large. Max size is {MAX_IMPORT_BYTES // (1024*1024)}MB.")
+    try:
+        # Starlette spools large uploads to a temporary file, which is read line by line
+        stats = import_user_data(db, current_user.id, file.file, UPLOAD_DIR)
+    except ImportFormatError as e:
+        logger.error(f"Import failed for user {current_user.username}: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"User {current_user.username} imported {stats}")
+    return stats
+
 @router.get("/query/{uuid}", status_code=200)
 def query_data(
     uuid: uuid_pkg.UUID,
     query: str = Query(
         ..., description="The query to ask the LLM.", min_length=1, max_length=1000
     ),
+    pages: Optional[str] = Query(
+        None, description="Restrict the context to a page range, e.g. 3-7, 5 or 10-."
+    ),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
@@ -201,12 +410,140 @@ def query_data(
             status_code=404,
             detail=f"UUID {uuid_str} not found. Use POST to upload the PDF.",
         )
-    llm_response = get_llm_response(context=doc.extracted_text, query=query)
+    with llm_caller(current_user.id, INTERACTIVE):
+        llm_response = get_llm_response(context=get_document_context(doc, pages), query=query)
     logger.info(f"User {current_user.username} queried document {uuid_str}")
     return {
         "uuid": uuid_str,
         "query": query,
         "llm_response": llm_response,
+        "model": llm_response.model,
+    }
+
+def answer_question_group(context: str, questions: List[str]) -> List[dict]:
+    """Answer a group of questions with one LLM call, reporting failures per question."""
+    try:
+        answers = get_batch_llm_response(context=context, questions=questions)
+    except Exception as e:
+        logger.error(f"Batch query group failed: {str(e)}")
+        return [{"answer": None, "error": str(e)} for _ in questions]
+    return [
+        {"answer": answer, "error": None if answer is not None else "No answer returned for this question."}
+        for answer in answers
+    ]
+
+def answer_question_groups(context: str, groups: List[List[str]]) -> List[dict]:
+    """Answer groups of questions one LLM call after the other."""
+    return [outcome for group in groups for outcome in answer_question_group(context, group)]
+
+@router.post("/query/{uuid}/batch", status_code=200)
+def batch_query_data(
+    uuid: uuid_pkg.UUID,
+    batch_request: BatchQueryRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Answer a list of questions about one document, packing several questions per LLM call."""
+    uuid_str = str(uuid)
+    for question in batch_request.questions:
+        if not 1 <= len(question) <= 1000:
+            raise HTTPException(status_code=400, detail="Each question must be between 1 and 1000 characters.")
+    doc = db.query(Document).filter_by(uuid=uuid_str, user_id=current_user.id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    context = get_document_context(doc, batch_request.pages)
+
+    # The whole batch is admitted before any call starts, then its groups share
+    # one context string and run concurrently on the slots it was admitted for
+    size = batch_request.questions_per_call
+    groups = [batch_request.questions[start:start + size] for start in range(0, len(batch_request.questions), size)]
+    with admitted_batch(current_user.id, len(groups), len(context)) as slots:
+        per_worker = -(-len(groups) // slots)
+        futures = [
+            batch_executor.submit(copy_context().run, answer_question_groups, context, groups[start:start + per_worker])
+            for start in range(0, len(groups), per_worker)
+        ]
+        outcomes = [outcome for future in futures for outcome in future.result()]
+
+    logger.info(f"User {current_user.username} batch queried document {uuid_str} with {len(batch_request.questions)} questions")
+    return {
+        "uuid": uuid_str,
+        "results": [
+            {"index": index, "question": question, **outcome}
+            for index, (question, outcome) in enumerate(zip(batch_request.questions, outcomes))
+        ],
+    }
+
+@router.post("/query/multi", status_code=200)
+def query_multiple_documents(
+    query_request: MultiDocumentQueryRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Answer a query across several documents (or all documents) of the current user."""
+    documents = db.query(Document.id, Document.uuid, Document.filename).filter_by(user_id=current_user.id)
+    requested = None
+    if query_request.document_uuids:
+        requested = list(dict.fromkeys(str(document_uuid) for document_uuid in query_request.document_uuids))
+        documents = documents.filter(Document.uuid.in_(requested))
+    documents = documents.order_by(Document.id).all()
+    if not documents:
+        raise HTTPException(status_code=404, detail="No documents found.")
+    if len(documents) > MAX_MULTI_QUERY_DOCUMENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many documents. Max {MAX_MULTI_QUERY_DOCUMENTS} documents per query.",
+        )
+    if requested is not None:
+        order = {document_uuid: index for index, document_uuid in enumerate(requested)}
+        documents.sort(key=lambda document: order[document.uuid])
+
+    # Load every text in one query and split it into passages, count their terms
+    # (in parallel for large requests), then rank all passages together and merge them under one budget
+    texts = {
+        row.id: row
+        for row in db.query(Document.id, Document.extracted_text, Document.page_offsets).filter(
+            Document.id.in_([document.id for document in documents])
+        )
+    }
+    per_document = [
+        split_passages(document.uuid, document.filename, texts[document.id].extracted_text, texts[document.id].page_offsets)
+        if document.id in texts else []  # Deleted since the documents were listed
+        for document in documents
+    ]
+    terms = query_terms(query_request.query)
+    count_terms(per_document, terms)
+    per_document = rank_passages(per_document, terms, MULTI_QUERY_PASSAGES_PER_DOCUMENT)
+    passages = merge_passages(per_document, query_request.max_context_chars)
+
+    with llm_caller(current_user.id, INTERACTIVE):
+        raw_response = get_multi_document_response(context=format_passages(passages), query=query_request.query)
+    try:
+        parsed = json.loads(raw_response)
+        answer = parsed["answer"]
+        sources = {source["document_uuid"]: source for source in parsed.get("sources", [])}
+    except (ValueError, KeyError, TypeError):
+        answer, sources = raw_response, {}
+
+    found = {document.uuid for document in documents}
+    result_documents = []
+    for document in documents:
+        pages = sorted({passage.page for passage in passages if passage.document_uuid == document.uuid and passage.page is not None})
+        source = sources.get(document.uuid, {})
+        result_documents.append({
+            "uuid": document.uuid,
+            "filename": document.filename,
+            "context_pages": pages,
+            "cited_pages": source.get("pages", []),
+            "contribution": source.get("contribution"),
+        })
+    logger.info(f"User {current_user.username} queried {len(documents)} documents")
+    return {
+        "query": query_request.query,
+        "llm_response": answer,
+        "model": raw_response.model,
+        "documents": result_documents,
+        "missing_uuids": [document_uuid for document_uuid in requested or [] if document_uuid not in found],
     }
 
 @router.delete("/delete/{uuid}", status_code=200)
@@ -219,6 +556,12 @@ def delete_data(uuid: uuid_pkg.UUID, db: Session = Depends(get_db), current_user
             status_code=404,
             detail=f"UUID {uuid_str} not found. Use POST to upload the PDF.",
         )
+    # Conversations reference the document, so they go first, with their messages and search entries
+    conversation_ids = [conversation_id for (conversation_id,) in db.query(Conversation.id).filter_by(document_id=doc.id)]
+    if conversation_ids:
+        remove_conversations(db, conversation_ids)
+        db.query(ChatMessage).filter(ChatMessage.conversation_id.in_(conversation_ids)).delete(synchronize_session=False)
+        db.query(Conversation).filter(Conversation.id.in_(conversation_ids)).delete(synchronize_session=False)
     db.delete(doc)
     db.commit()
     if os.path.exists(doc.file_path):
@@ -234,30 +577,101 @@ def list_all_uuids(db: Session = Depends(get_db), current_user: User = Depends(g
             for doc in db.query(Document).filter_by(user_id=current_user.id).all()
         ]
         return {"pdfs": pdfs}
-    except Exception as e:
-        print("Error in list_all_uuids:", str(e))
+    except Exception:
+        logger.exception(f"Listing documents failed for user {current_user.username}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @router.get("/download/{uuid}", response_class=FileResponse)
-def download_pdf(uuid: uuid_pkg.UUID, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def download_pdf(uuid: uuid_pkg.UUID, request: Request, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     uuid_str = str(uuid)
-    doc = db.query(Document).filter_by(uuid=uuid_str, user_id=current_user.id).first()
+    # Only the file metadata is needed, not the extracted text
+    doc = (
+        db.query(Document.id, Document.filename, Document.file_path, Document.file_sha256)
+        .filter_by(uuid=uuid_str, user_id=current_user.id)
+        .first()
+    )
     if not doc:
         logger.error(f"Download failed: Document {uuid_str} not found for user {current_user.username}")
         raise HTTPException(status_code=404, detail="Document not found or access denied.")
-    if not os.path.exists(doc.file_path):
+    try:
+        stat_result = os.stat(doc.file_path)
+    except FileNotFoundError:
         logger.error(f"Download failed: File not found for document {uuid_str} by user {current_user.username}")
         raise HTTPException(status_code=404, detail="File not found on server.")
+    sha256 = doc.file_sha256
+    if sha256 is None:
+        # Documents uploaded before content hashes were stored are hashed once, on first download
+        sha256 = file_sha256(doc.file_path)
+        db.query(Document).filter_by(id=doc.id).update({Document.file_sha256: sha256})
+        db.commit()
+    headers = {
+        "ETag": strong_etag(sha256),
+        "Last-Modified": http_date(stat_result.st_mtime),
+        "Cache-Control": PRIVATE_CACHE_CONTROL,
+    }
+    if is_not_modified(request.headers, headers["ETag"], stat_result.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
     logger.info(f"User {current_user.username} downloaded document {uuid_str}")
-    return FileResponse(path=doc.file_path, filename=doc.filename, media_type="application/pdf")
+    # FileResponse serves Range requests (206) and honours If-Range against the ETag above
+    return FileResponse(path=doc.file_path, filename=doc.filename, media_type="application/pdf", headers=headers, stat_result=stat_result)
+
+@router.get("/pages/{uuid}", status_code=200)
+def get_document_pages(
+    uuid: uuid_pkg.UUID,
+    from_page: int = Query(1, alias="from", ge=1, description="First page to return (1-based)."),
+    to_page: Optional[int] = Query(None, alias="to", ge=1, description="Last page to return, inclusive. Defaults to the last page."),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Return the stored text of a page range of a document."""
+    uuid_str = str(uuid)
+    doc = db.query(Document).filter_by(uuid=uuid_str, user_id=current_user.id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    require_page_index(doc)
+    total_pages = page_count(doc.page_offsets)
+    if to_page is not None and to_page < from_page:
+        raise HTTPException(status_code=400, detail="'to' must not be smaller than 'from'.")
+    if from_page > total_pages:
+        raise HTTPException(status_code=400, detail=f"Page {from_page} out of range. Document has {total_pages} pages.")
+    pages = get_pages(doc.extracted_text, doc.page_offsets, from_page, to_page or total_pages)
+    return {
+        "uuid": uuid_str,
+        "page_count": total_pages,
+        "pages": [{"page": number, "text": page_text} for number, page_text in pages],
+    }
 
 
 # ===== NEW CHAT ENDPOINTS =====
 
+def refine_conversation_title(user_id: int, conversation_id: int, first_query: str, provisional_title: str):
+    """Replace the provisional title of a new conversation with an LLM-generated one."""
+    with llm_caller(user_id, BULK):
+        title = generate_conversation_title(first_query)
+    if not title or title == provisional_title:
+        return
+    db = SessionLocal()
+    try:
+        # Only patch titles that have not been changed since the conversation was created
+        conversation = db.query(Conversation).filter_by(id=conversation_id, title=provisional_title).first()
+        updated = conversation is not None
+        if updated:
+            conversation.title = title
+            index_title(db, conversation.user_id, conversation.id, title)
+        db.commit()
+        if updated:
+            logger.info(f"Refined title of conversation {conversation_id}")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Title refinement failed for conversation {conversation_id}: {str(e)}")
+    finally:
+        db.close()
+
 @router.post("/chat/start/{document_uuid}", response_model=ConversationResponse)
 def start_conversation(
     document_uuid: uuid_pkg.UUID,
     message_request: ChatMessageRequest,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -269,9 +683,15 @@ def start_conversation(
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found.")
     
-    # Create new conversation
+    # Validate the page range and get the answer before anything is stored, so
+    # that a rejected request does not leave an empty conversation behind
+    context = get_document_context(doc, message_request.pages)
+    with llm_caller(current_user.id, INTERACTIVE):
+        llm_response = get_llm_response(context=context, query=message_request.message)
+    
+    # Create new conversation with a local title; the LLM title is generated after the response is sent
     conversation_uuid = str(uuid_pkg.uuid4())
-    conversation_title = generate_conversation_title(message_request.message)
+    conversation_title = quick_conversation_title(message_request.message)
     
     conversation = Conversation(
         uuid=conversation_uuid,
@@ -280,8 +700,7 @@ def start_conversation(
         document_id=doc.id
     )
     db.add(conversation)
-    db.commit()
-    db.refresh(conversation)
+    db.flush()
     
     # Add user message
     user_message = ChatMessage(
@@ -291,25 +710,27 @@ def start_conversation(
     )
     db.add(user_message)
     
-    # Get LLM response (single message, no history yet)
-    llm_response = get_llm_response(context=doc.extracted_text, query=message_request.message)
-    
     # Add assistant message
     assistant_message = ChatMessage(
         conversation_id=conversation.id,
         role="assistant",
-        content=llm_response
+        content=llm_response,
+        model=llm_response.model
     )
     db.add(assistant_message)
     
     # Update conversation timestamp
     conversation.updated_at = datetime.now(UTC)
+    db.flush()
+    index_title(db, current_user.id, conversation.id, conversation.title)
+    index_messages(db, current_user.id, [user_message, assistant_message])
     db.commit()
+    background_tasks.add_task(refine_conversation_title, current_user.id, conversation.id, message_request.message, conversation_title)
     
     # Return conversation with messages
     messages = [
         ChatMessageResponse(role=user_message.role, content=user_message.content, timestamp=user_message.timestamp),
-        ChatMessageResponse(role=assistant_message.role, content=assistant_message.content, timestamp=assistant_message.timestamp)
+        ChatMessageResponse(role=assistant_message.role, content=assistant_message.content, timestamp=assistant_message.timestamp, model=assistant_message.model)
     ]
     
     logger.info(f"User {current_user.username} started conversation {conversation_uuid} with document {document_uuid_str}")
@@ -354,22 +775,26 @@ def continue_conversation(
     db.add(user_message)
     
     # Get LLM response with conversation history
-    llm_response = get_chat_response(
-        context=conversation.document.extracted_text,
-        conversation_history=conversation_history,
-        new_query=message_request.message
-    )
+    with llm_caller(current_user.id, INTERACTIVE):
+        llm_response = get_chat_response(
+            context=get_document_context(conversation.document, message_request.pages),
+            conversation_history=conversation_history,
+            new_query=message_request.message
+        )
     
     # Add assistant message
     assistant_message = ChatMessage(
         conversation_id=conversation.id,
         role="assistant",
-        content=llm_response
+        content=llm_response,
+        model=llm_response.model
     )
     db.add(assistant_message)
     
     # Update conversation timestamp
     conversation.updated_at = datetime.now(UTC)
+    db.flush()
+    index_messages(db, current_user.id, [user_message, assistant_message])
     db.commit()
     
     logger.info(f"User {current_user.username} continued conversation {conversation_uuid_str}")
@@ -377,7 +802,8 @@ def continue_conversation(
     return ChatMessageResponse(
         role=assistant_message.role,
         content=assistant_message.content,
-        timestamp=assistant_message.timestamp
+        timestamp=assistant_message.timestamp,
+        model=assistant_message.model
     )
 
 @router.get("/chat/conversations", response_model=List[dict])
@@ -405,6 +831,36 @@ def get_conversations(
     
     return result
 
+@router.get("/chat/search", status_code=200)
+def search_conversations(
+    q: str = Query(..., description="Words to search for in messages and conversation titles.", min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Full-text search over the current user's messages and conversation titles."""
+    # Fetch one extra hit to know whether another page exists
+    hits = search(db, current_user.id, q, limit + 1, offset)
+    return {
+        "query": q,
+        "results": [
+            {
+                "conversation_uuid": hit.conversation_uuid,
+                "conversation_title": hit.conversation_title,
+                "kind": hit.kind,
+                "role": hit.role,
+                "snippet": hit.snippet,
+                "timestamp": hit.timestamp,
+                "score": hit.score,
+            }
+            for hit in hits[:limit]
+        ],
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(hits) > limit,
+    }
+
 @router.get("/chat/conversation/{conversation_uuid}", response_model=ConversationResponse)
 def get_conversation(
     conversation_uuid: uuid_pkg.UUID,
@@ -423,7 +879,7 @@ def get_conversation(
         raise HTTPException(status_code=404, detail="Conversation not found.")
     
     messages = [
-        ChatMessageResponse(role=msg.role, content=msg.content, timestamp=msg.timestamp)
+        ChatMessageResponse(role=msg.role, content=msg.content, timestamp=msg.timestamp, model=msg.model)
         for msg in conversation.messages
     ]
     
@@ -451,8 +907,9 @@ def delete_conversation(
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found.")
     
-    # Soft delete
+    # Soft delete; the maintenance worker purges it after the retention period
     conversation.is_active = False
+    conversation.deleted_at = datetime.now(UTC)
     db.commit()
     
     logger.info(f"User {current_user.username} deleted conversation {conversation_uuid_str}")
@@ -476,7 +933,8 @@ def generate_summary(
     
     try:
         # Generate summary using LLM
-        summary = generate_document_summary(doc.extracted_text, doc.filename)
+        with llm_caller(current_user.id, BULK):
+            summary = generate_document_summary(doc.extracted_text, doc.filename)
         
         # Save summary to database
         doc.summary = summary
@@ -491,6 +949,8 @@ def generate_summary(
             summary=summary,
             summary_generated_at=doc.summary_generated_at
         )
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Summary generation failed for user {current_user.username}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating summary: {str(e)}")
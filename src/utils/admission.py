@@ -0,0 +1,308 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from src.utils.metrics import LLM_ACTIVE_CALLS, LLM_ADMISSION_REJECTIONS, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT
+from src.utils.profiling import span
+
+INTERACTIVE, BULK = "interactive", "bulk"
+# Share of LLM capacity per call class: a user's interactive calls advance
+# their place in the fair queue four times slower than bulk calls
+PRIORITY_WEIGHTS = {INTERACTIVE: 4.0, BULK: 1.0}
+
+# Limits apply per worker process. Waiting calls hold a request thread, so
+# LLM_MAX_CONCURRENCY + LLM_MAX_QUEUE should stay below the thread pool size (40).
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "24"))
+LLM_MAX_QUEUE_PER_USER = int(os.environ.get("LLM_MAX_QUEUE_PER_USER", "6"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "30"))
+# Token bucket per user; a rate of 0 disables rate limiting
+LLM_USER_RATE_PER_MINUTE = float(os.environ.get("LLM_USER_RATE_PER_MINUTE", "60"))
+LLM_USER_BURST = float(os.environ.get("LLM_USER_BURST", "20"))
+# Concurrent calls a single batch request may run
+LLM_MAX_SLOTS_PER_REQUEST = int(os.environ.get("LLM_MAX_SLOTS_PER_REQUEST", "4"))
+# Prompt characters that count as one extra unit of cost in the fair queue
+COST_CHARS = 20_000
+PRUNE_EVERY = 256
+
+
+class AdmissionRejected(HTTPException):
+    """An LLM call that was not admitted, answered with 429 and a Retry-After header."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float, tokens: float = 1.0) -> float:
+        """Take ``tokens`` tokens. Returns 0 on success, otherwise the seconds until enough are available."""
+        self.refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+@dataclass(order=True)
+class _Waiter:
+    start_tag: float
+    sequence: int
+    user_key: Hashable = field(compare=False)
+    priority: str = field(compare=False)
+    enqueued: float = field(compare=False)
+    slots: int = field(compare=False, default=1)
+    granted: threading.Event = field(compare=False, default_factory=threading.Event)
+
+
+class AdmissionController:
+    """
+    Admits LLM calls under a global concurrency limit, fairly across users.
+
+    Every user has a token bucket limiting their call rate. Calls that cannot
+    start immediately wait in a bounded queue ordered by start-time fair
+    queuing: each user is a flow whose virtual time advances by
+    ``cost / priority weight`` per call, so a user flooding the queue only
+    delays their own calls, and interactive calls overtake bulk ones.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        max_queue_per_user: int = LLM_MAX_QUEUE_PER_USER,
+        rate_per_minute: float = LLM_USER_RATE_PER_MINUTE,
+        burst: float = LLM_USER_BURST,
+        timeout: float = LLM_QUEUE_TIMEOUT,
+        clock=time.monotonic,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.timeout = timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue: List[_Waiter] = []
+        self._queued_per_user: Dict[Hashable, int] = {}
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._finish_tags: Dict[Hashable, float] = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+        # Moving average of call duration, used to estimate Retry-After
+        self._average_call_seconds = 5.0
+
+    def _reject(self, priority: str, reason: str, detail: str, retry_after: float):
+        LLM_ADMISSION_REJECTIONS.labels(priority=priority, reason=reason).inc()
+        raise AdmissionRejected(detail, retry_after)
+
+    def _estimated_wait(self, queued: int) -> float:
+        return self._average_call_seconds * (queued + 1) / self.max_concurrency
+
+    def _prune(self, now: float):
+        """Forget users whose bucket is full again and who have nothing queued."""
+        for user_key in [key for key, bucket in self._buckets.items() if bucket.is_full(now)]:
+            if not self._queued_per_user.get(user_key):
+                del self._buckets[user_key]
+        for user_key in [key for key, tag in self._finish_tags.items() if tag <= self._virtual_time]:
+            if not self._queued_per_user.get(user_key):
+                del self._finish_tags[user_key]
+
+    def acquire(
+        self, user_key: Optional[Hashable], priority: str = INTERACTIVE, cost: float = 1.0, slots: int = 1, calls: int = 1
+    ) -> float:
+        """
+        Wait until the call may start.
+
+        Args:
+            user_key (Optional[Hashable]): The calling user, None for calls made by the system itself.
+            priority (str): INTERACTIVE or BULK.
+            cost (float): Relative size of the call.
+            slots (int): Concurrency slots to hold, for a request running several calls at once.
+            calls (int): LLM calls the request makes, each taking a token from the user's bucket.
+
+        Returns:
+            float: Seconds spent waiting in the queue.
+
+        Raises:
+            AdmissionRejected: If the user is over their rate limit, the queue is full or the wait timed out.
+        """
+        now = self.clock()
+        with self._lock:
+            sequence = next(self._sequence)
+            if sequence % PRUNE_EVERY == 0:
+                self._prune(now)
+            bucket = None
+            if user_key is not None and self.rate > 0:
+                bucket = self._buckets.get(user_key)
+                if bucket is None:
+                    bucket = self._buckets[user_key] = TokenBucket(self.rate, self.burst, now)
+                retry_after = bucket.take(now, calls)
+                if retry_after:
+                    self._reject(priority, "rate_limit", "Too many LLM requests. Please slow down.", retry_after)
+
+            start_tag = max(self._virtual_time, self._finish_tags.get(user_key, 0.0))
+            if self._active + slots <= self.max_concurrency and not self._queue:
+                self._finish_tags[user_key] = start_tag + cost / PRIORITY_WEIGHTS[priority]
+                self._virtual_time = start_tag
+                self._active += slots
+                LLM_ACTIVE_CALLS.inc(slots)
+                LLM_QUEUE_WAIT.labels(priority=priority).observe(0)
+                return 0.0
+            if len(self._queue) >= self.max_queue or self._queued_per_user.get(user_key, 0) >= self.max_queue_per_user:
+                if bucket is not None:
+                    bucket.tokens += calls  # the calls never ran
+                self._reject(
+                    priority, "queue_full", "The server is busy. Please retry later.", self._estimated_wait(len(self._queue))
+                )
+            self._finish_tags[user_key] = start_tag + cost / PRIORITY_WEIGHTS[priority]
+            waiter = _Waiter(start_tag, sequence, user_key, priority, now, slots=slots)
+            heapq.heappush(self._queue, waiter)
+            self._queued_per_user[user_key] = self._queued_per_user.get(user_key, 0) + 1
+            LLM_QUEUE_DEPTH.labels(priority=priority).inc()
+
+        with span("llm: admission wait"):
+            waiter.granted.wait(self.timeout)
+        waited = self.clock() - waiter.enqueued
+        with self._lock:
+            # Checked under the lock because a slot may be granted right after the timeout
+            if not waiter.granted.is_set():
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                self._leave_queue(waiter)
+                self._reject(priority, "timeout", "The server is busy. Please retry later.", self._estimated_wait(len(self._queue)))
+        LLM_QUEUE_WAIT.labels(priority=priority).observe(waited)
+        return waited
+
+    def _leave_queue(self, waiter: _Waiter):
+        remaining = self._queued_per_user[waiter.user_key] - 1
+        if remaining:
+            self._queued_per_user[waiter.user_key] = remaining
+        else:
+            del self._queued_per_user[waiter.user_key]
+        LLM_QUEUE_DEPTH.labels(priority=waiter.priority).dec()
+
+    def release(self, duration: Optional[float], slots: int = 1):
+        """
+        Free the slots of a finished call and start the next waiting calls, if any.
+
+        ``duration`` feeds the Retry-After estimate. It is None for a batch, whose
+        duration says little about the duration of a single call.
+        """
+        with self._lock:
+            if duration is not None:
+                self._average_call_seconds += 0.1 * (duration - self._average_call_seconds)
+            self._active -= slots
+            LLM_ACTIVE_CALLS.dec(slots)
+            # Calls are started in queue order, so a batch at the head waits for enough free slots
+            while self._queue and self._active + self._queue[0].slots <= self.max_concurrency:
+                waiter = heapq.heappop(self._queue)
+                self._leave_queue(waiter)
+                self._virtual_time = waiter.start_tag
+                self._active += waiter.slots
+                LLM_ACTIVE_CALLS.inc(waiter.slots)
+                waiter.granted.set()
+
+
+controller = AdmissionController()
+
+# The user and priority that LLM calls made in the current context are admitted as
+_caller: ContextVar[Optional[Tuple[Hashable, str]]] = ContextVar("llm_caller", default=None)
+# Set while the calls of the current context were admitted together, see admitted_batch
+_batch_admitted: ContextVar[bool] = ContextVar("llm_batch_admitted", default=False)
+
+
+@contextmanager
+def llm_caller(user_id: Hashable, priority: str = INTERACTIVE):
+    """Admit the LLM calls made inside the block on behalf of ``user_id``."""
+    token = _caller.set((user_id, priority))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+@contextmanager
+def admitted_batch(user_id: Hashable, calls: int, input_chars: int) -> Iterator[int]:
+    """
+    Admit all LLM calls of one batch request at once, as bulk work of ``user_id``.
+
+    The batch takes one token per call from the user's bucket up front, and a
+    single place in the queue with the cost of all its calls. Once admitted it
+    holds up to LLM_MAX_SLOTS_PER_REQUEST slots, and the calls made inside the
+    block are not admitted again, so a batch is either rejected before any
+    call runs or runs to completion.
+
+    Args:
+        user_id (Hashable): The calling user.
+        calls (int): LLM calls the batch makes.
+        input_chars (int): Prompt size of each call.
+
+    Yields:
+        int: The number of calls the batch may run concurrently.
+
+    Raises:
+        HTTPException: If the batch makes more calls than the user's burst allows, so it could never be admitted.
+        AdmissionRejected: If the batch is not admitted.
+    """
+    if controller.rate > 0 and calls > controller.burst:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"This batch needs {calls} LLM calls but at most {controller.burst:g} may start at once. "
+            "Ask more questions per call.",
+        )
+    slots = max(1, min(calls, LLM_MAX_SLOTS_PER_REQUEST, controller.max_concurrency))
+    controller.acquire(user_id, BULK, calls * (1 + input_chars / COST_CHARS), slots, calls)
+    caller_token = _caller.set((user_id, BULK))
+    batch_token = _batch_admitted.set(True)
+    try:
+        yield slots
+    finally:
+        _batch_admitted.reset(batch_token)
+        _caller.reset(caller_token)
+        controller.release(None, slots)
+
+
+@contextmanager
+def admitted(input_chars: int):
+    """Hold an admission slot for one LLM call of the current caller."""
+    if _batch_admitted.get():
+        yield
+        return
+    user_key, priority = _caller.get() or (None, BULK)
+    controller.acquire(user_key, priority, 1 + input_chars / COST_CHARS)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        controller.release(time.monotonic() - started)
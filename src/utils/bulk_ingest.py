@@ -0,0 +1,149 @@
+import hashlib
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import BinaryIO, Iterator, List, Tuple
+
+from src.utils.page_index import join_pages
+from src.utils.pdf_processor import extract_pages_timed, pypdf
+
+# Text extraction is CPU-bound pure Python, so bulk uploads are extracted in
+# separate processes rather than threads
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+COPY_CHUNK_SIZE = 1024 * 1024
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed", "multipart/x-zip"}
+
+
+class IngestError(Exception):
+    """A file of a bulk upload that cannot be ingested. The message is reported to the client."""
+
+
+@lru_cache(maxsize=1)
+def ingest_executor() -> ProcessPoolExecutor:
+    """The process pool shared by bulk uploads, started on first use."""
+    # Forking a process that runs server threads is unsafe, so workers are spawned
+    return ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def submit_extraction(file_path: str, max_pages: int):
+    """Schedule ``validate_and_extract`` on the ingest pool, replacing the pool if a worker died."""
+    try:
+        return ingest_executor().submit(validate_and_extract, file_path, max_pages)
+    except BrokenProcessPool:
+        ingest_executor.cache_clear()
+        return ingest_executor().submit(validate_and_extract, file_path, max_pages)
+
+
+def is_zip(filename: str, content_type: str) -> bool:
+    return content_type in ZIP_CONTENT_TYPES or filename.lower().endswith(".zip")
+
+
+def copy_limited(source: BinaryIO, destination_path: str, max_size: int) -> str:
+    """
+    Copy a stream to a file in chunks, hashing it on the way.
+
+    Raises:
+        IngestError: If the stream is empty or larger than ``max_size``. The partial file is removed.
+
+    Returns:
+        str: The SHA-256 hex digest of the content.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(destination_path, "wb") as destination:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_size:
+                    raise IngestError(f"File too large. Max size is {max_size // (1024 * 1024)}MB.")
+                digest.update(chunk)
+                destination.write(chunk)
+        if size == 0:
+            raise IngestError("Uploaded file is empty.")
+    except BaseException:
+        os.remove(destination_path)
+        raise
+    return digest.hexdigest()
+
+
+def zip_members(archive: BinaryIO) -> Iterator[Tuple[str, zipfile.ZipInfo, zipfile.ZipFile]]:
+    """
+    Iterate over the files of a ZIP archive read from a seekable stream, skipping directories and macOS metadata.
+
+    Yields:
+        Tuple[str, zipfile.ZipInfo, zipfile.ZipFile]: The member's base name (without its folders, so
+        entries cannot escape the upload directory), its info and the open archive to read it from.
+
+    Raises:
+        IngestError: If the stream is not a valid ZIP archive.
+    """
+    try:
+        zip_file = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise IngestError("Invalid or corrupted ZIP archive.")
+    with zip_file:
+        for info in zip_file.infolist():
+            name = os.path.basename(info.filename.replace("\\", "/"))
+            if info.is_dir() or not name or info.filename.startswith("__MACOSX/") or name.startswith("._"):
+                continue
+            yield name, info, zip_file
+
+
+def extract_member(zip_file: zipfile.ZipFile, info: zipfile.ZipInfo, destination_path: str, max_size: int) -> str:
+    """Decompress one ZIP member to disk in chunks, see ``copy_limited``."""
+    # The declared size is checked first, the actual size while copying, as it can be forged
+    if info.file_size > max_size:
+        raise IngestError(f"File too large. Max size is {max_size // (1024 * 1024)}MB.")
+    try:
+        with zip_file.open(info) as source:
+            return copy_limited(source, destination_path, max_size)
+    except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+        # Corrupted data, unsupported compression or encrypted members
+        raise IngestError(f"Cannot extract from ZIP archive: {e}")
+
+
+def validate_pdf(file_path: str, max_pages: int):
+    """
+    Check that a stored file is a readable PDF of at most ``max_pages`` pages.
+
+    Raises:
+        IngestError: If the PDF is invalid or too long.
+    """
+    try:
+        page_total = len(pypdf.PdfReader(file_path).pages)
+    except Exception:
+        raise IngestError("Invalid or corrupted PDF file.")
+    if page_total > max_pages:
+        raise IngestError(f"PDF too long. Max {max_pages} pages allowed.")
+
+
+def validate_and_extract(file_path: str, max_pages: int) -> Tuple[str, bytes, List[float]]:
+    """
+    Validate a stored PDF and extract its text. Runs in an ingest worker process.
+
+    Metrics recorded in a worker process never reach /metrics, so the page
+    timings are returned for the caller to record with ``record_page_timings``.
+
+    Returns:
+        Tuple[str, bytes, List[float]]: The extracted text, its encoded page offsets and the seconds each page took.
+
+    Raises:
+        IngestError: If the PDF is invalid, too long or has no text.
+    """
+    validate_pdf(file_path, max_pages)
+    pages, page_seconds = extract_pages_timed(file_path)
+    extracted_text, page_offsets = join_pages(pages)
+    if not extracted_text.strip():
+        raise IngestError("Error extracting text from PDF.")
+    return extracted_text, page_offsets, page_seconds
+
+
+def discard(file_path: str):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
@@ -0,0 +1,168 @@
+import argparse
+import base64
+import os
+import time
+import zlib
+
+from loguru import logger
+from sqlalchemy import bindparam, column, select, table, update
+from sqlalchemy.types import Text, TypeDecorator
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+# Compressed values look like "\x1f<codec>:<base64 payload>". Plain rows written
+# before compression was enabled have no marker and are returned unchanged.
+MARKER = "\x1f"
+ZLIB, ZSTD, ESCAPED = "z", "s", "p"
+COMPRESSION_MIN_CHARS = int(os.environ.get("TEXT_COMPRESSION_MIN_CHARS", "1024"))
+COMPRESSION_CODEC = os.environ.get("TEXT_COMPRESSION_CODEC", "zstd" if zstandard else "zlib")
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 6
+
+if COMPRESSION_CODEC == "zstd" and zstandard is None:
+    logger.warning("TEXT_COMPRESSION_CODEC=zstd but the zstandard package is not installed, using zlib")
+    COMPRESSION_CODEC = "zlib"
+
+
+def compress_text(value: str) -> str:
+    """
+    Compress a text value for storage if it is large enough to benefit.
+
+    Args:
+        value (str): The plain text.
+
+    Returns:
+        str: The stored representation, either the plain text or a marked, compressed payload.
+    """
+    if value is None:
+        return None
+    if len(value) < COMPRESSION_MIN_CHARS:
+        # Short values that happen to start with the marker must not be mistaken for compressed data
+        return MARKER + ESCAPED + ":" + value if value.startswith(MARKER) else value
+    raw = value.encode("utf-8")
+    if COMPRESSION_CODEC == "zstd":
+        codec, payload = ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    else:
+        codec, payload = ZLIB, zlib.compress(raw, ZLIB_LEVEL)
+    encoded = base64.b64encode(payload).decode("ascii")
+    if len(encoded) + 3 >= len(value):
+        return MARKER + ESCAPED + ":" + value if value.startswith(MARKER) else value
+    return MARKER + codec + ":" + encoded
+
+
+def decompress_text(value: str) -> str:
+    """Return the plain text of a stored value, compressed or not."""
+    if not value or not value.startswith(MARKER) or value[2:3] != ":" or value[1] not in (ZLIB, ZSTD, ESCAPED):
+        return value
+    codec, payload = value[1], value[3:]
+    if codec == ESCAPED:
+        return payload
+    data = base64.b64decode(payload)
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is required to read zstd-compressed text.")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def is_compressed(value: str) -> bool:
+    return bool(value) and value.startswith(MARKER) and value[1:2] in (ZLIB, ZSTD) and value[2:3] == ":"
+
+
+class CompressedText(TypeDecorator):
+    """A TEXT column whose large values are transparently compressed."""
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
+
+# (table, column) pairs stored as CompressedText
+COMPRESSED_COLUMNS = [
+    ("documents", "extracted_text"),
+    ("documents", "summary"),
+    ("chat_messages", "content"),
+]
+
+
+def migrate(engine, batch_size: int = 500, pause: float = 0.0, dry_run: bool = False) -> dict:
+    """
+    Compress existing plain rows in place, one small transaction per batch.
+
+    Rows are read untyped, so already compressed values are recognised and skipped.
+    The migration can be interrupted and resumed at any time.
+
+    Args:
+        engine: The SQLAlchemy engine.
+        batch_size (int): Rows read per batch.
+        pause (float): Seconds to sleep between batches, to limit load on a live database.
+        dry_run (bool): Only report what would change.
+
+    Returns:
+        dict: Rows scanned and rewritten and characters before and after, per column.
+    """
+    from src.models import Base
+
+    report = {}
+    for table_name, column_name in COMPRESSED_COLUMNS:
+        raw_table = table(table_name, column("id"), column(column_name))
+        typed_table = Base.metadata.tables[table_name]
+        statement = (
+            update(typed_table)
+            .where(typed_table.c.id == bindparam("row_id"))
+            .values({column_name: bindparam("value", type_=CompressedText())})
+        )
+        stats = {"scanned": 0, "rewritten": 0, "chars_before": 0, "chars_after": 0}
+        last_id = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    select(raw_table.c.id, raw_table.c[column_name])
+                    .where(raw_table.c.id > last_id)
+                    .order_by(raw_table.c.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                changes = []
+                for row_id, value in rows:
+                    stats["scanned"] += 1
+                    if value is None or is_compressed(value) or value.startswith(MARKER + ESCAPED + ":"):
+                        continue
+                    stored = compress_text(value)
+                    if stored == value:
+                        continue
+                    stats["rewritten"] += 1
+                    stats["chars_before"] += len(value)
+                    stats["chars_after"] += len(stored)
+                    changes.append({"row_id": row_id, "value": value})
+                if changes and not dry_run:
+                    conn.execute(statement, changes)
+            logger.info(f"Compression migration {table_name}.{column_name}: {stats}")
+            if pause:
+                time.sleep(pause)
+        report[f"{table_name}.{column_name}"] = stats
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress existing plain text rows in place.")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    from src.db import engine
+
+    for name, stats in migrate(engine, args.batch_size, args.pause, args.dry_run).items():
+        print(f"{name}: {stats}")
@@ -0,0 +1,528 @@
+import base64
+import gzip
+import itertools
+import json
+import os
+import uuid as uuid_pkg
+import zlib
+from datetime import datetime, UTC
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+from loguru import logger
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from src.config import MAX_FILE_SIZE, MAX_IMPORT_BYTES, MAX_IMPORT_LINE_BYTES, MAX_PDF_PAGES
+from src.db import SessionLocal
+from src.models import ChatMessage, Conversation, Document
+from src.utils.bulk_ingest import IngestError, discard, validate_pdf
+from src.utils.http_cache import content_sha256
+from src.utils.search_index import index_messages, index_title
+
+# An export is one JSON object per line: a header, then every document, then
+# every conversation, then every message. Records refer to each other by UUID.
+EXPORT_FORMAT_VERSION = 1
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+GZIP_MEDIA_TYPE = "application/gzip"
+# Rows fetched per round trip from the server-side cursor
+EXPORT_FETCH_SIZE = 500
+# Bytes of output buffered before a chunk is sent
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Rows inserted per statement during an import. Documents carry their full text, so fewer are buffered.
+IMPORT_BATCH_SIZE = 1000
+IMPORT_DOCUMENT_BATCH_SIZE = 50
+GZIP_MAGIC = b"\x1f\x8b"
+# Base64 characters of a PDF of MAX_FILE_SIZE bytes
+MAX_PDF_BASE64_CHARS = 4 * -(-MAX_FILE_SIZE // 3)
+REQUIRED_FIELDS = {
+    "document": ("uuid", "filename", "extracted_text"),
+    "conversation": ("uuid", "document_uuid", "title"),
+    "message": ("conversation_uuid", "role", "content"),
+}
+# Namespace of the UUIDs given to records whose UUID belongs to another user
+IMPORT_UUID_NAMESPACE = uuid_pkg.UUID("d03af7ab-9ece-4cbf-a19b-5b3f722f9cc5")
+
+
+class ImportFormatError(ValueError):
+    """The uploaded file is not a valid export."""
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _message_key(role: str, timestamp: Optional[datetime], content: str) -> Tuple[str, Optional[datetime], str]:
+    """What identifies a message within its conversation, as messages have no UUID."""
+    return role, timestamp, content_sha256(content.encode("utf-8"))
+
+
+class _ChunkWriter:
+    """Serialize records to NDJSON, optionally gzipped, in chunks of about EXPORT_CHUNK_BYTES."""
+
+    def __init__(self, compress: bool):
+        # wbits=31 writes a gzip container, so the output can be read with gunzip
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self._buffer: List[bytes] = []
+        self._size = 0
+
+    def _encode(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) if self._compressor else data
+
+    def write(self, record: dict) -> Iterator[bytes]:
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._buffer.append(line)
+        self._size += len(line)
+        if self._size >= EXPORT_CHUNK_BYTES:
+            chunk = self._encode(b"".join(self._buffer))
+            self._buffer, self._size = [], 0
+            if chunk:
+                yield chunk
+
+    def close(self) -> Iterator[bytes]:
+        chunk = self._encode(b"".join(self._buffer))
+        if self._compressor:
+            chunk += self._compressor.flush()
+        if chunk:
+            yield chunk
+
+
+def _read_file_base64(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode("ascii")
+    except FileNotFoundError:
+        logger.warning(f"Export: file {path} is missing, exporting the document without it")
+        return None
+
+
+def export_user_data(user_id: int, compress: bool = False) -> Iterator[bytes]:
+    """
+    Stream every document, active conversation and message of a user as NDJSON.
+
+    Each table is walked with a server-side cursor (``yield_per``), one at a
+    time, and output is sent in small chunks, so memory use does not grow with
+    the amount of data. The generator opens its own session because it keeps
+    running after the endpoint has returned.
+
+    Args:
+        user_id (int): The user to export.
+        compress (bool): Gzip the output.
+
+    Yields:
+        bytes: Chunks of the export.
+    """
+    writer = _ChunkWriter(compress)
+    db = SessionLocal()
+    try:
+        yield from writer.write({
+            "type": "header",
+            "version": EXPORT_FORMAT_VERSION,
+            "exported_at": _timestamp(datetime.now(UTC)),
+        })
+        documents = (
+            db.query(
+                Document.uuid, Document.filename, Document.extracted_text, Document.page_offsets, Document.upload_date,
+                Document.file_path, Document.summary, Document.summary_generated_at,
+            )
+            .filter(Document.user_id == user_id)
+            .order_by(Document.id)
+            .yield_per(EXPORT_FETCH_SIZE)
+        )
+        for doc in documents:
+            yield from writer.write({
+                "type": "document",
+                "uuid": doc.uuid,
+                "filename": doc.filename,
+                "upload_date": _timestamp(doc.upload_date),
+                "extracted_text": doc.extracted_text,
+                "page_offsets": base64.b64encode(doc.page_offsets).decode("ascii") if doc.page_offsets else None,
+                "summary": doc.summary,
+                "summary_generated_at": _timestamp(doc.summary_generated_at),
+                "pdf": _read_file_base64(doc.file_path),
+            })
+
+        conversations = (
+            db.query(
+                Conversation.uuid, Document.uuid.label("document_uuid"), Conversation.title,
+                Conversation.created_at, Conversation.updated_at,
+            )
+            .join(Document, Document.id == Conversation.document_id)
+            .filter(Conversation.user_id == user_id, Conversation.is_active.is_(True))
+            .order_by(Conversation.id)
+            .yield_per(EXPORT_FETCH_SIZE)
+        )
+        for conversation in conversations:
+            yield from writer.write({
+                "type": "conversation",
+                "uuid": conversation.uuid,
+                "document_uuid": conversation.document_uuid,
+                "title": conversation.title,
+                "created_at": _timestamp(conversation.created_at),
+                "updated_at": _timestamp(conversation.updated_at),
+            })
+
+        messages = (
+            db.query(
+                Conversation.uuid.label("conversation_uuid"), ChatMessage.role, ChatMessage.content,
+                ChatMessage.model, ChatMessage.timestamp,
+            )
+            .join(Conversation, Conversation.id == ChatMessage.conversation_id)
+            .filter(Conversation.user_id == user_id, Conversation.is_active.is_(True))
+            .order_by(ChatMessage.id)
+            .yield_per(EXPORT_FETCH_SIZE)
+        )
+        for message in messages:
+            yield from writer.write({
+                "type": "message",
+                "conversation_uuid": message.conversation_uuid,
+                "role": message.role,
+                "content": message.content,
+                "model": message.model,
+                "timestamp": _timestamp(message.timestamp),
+            })
+        yield from writer.close()
+    finally:
+        db.close()
+
+
+class _Importer:
+    """
+    Insert the records of an export for one user, in batches.
+
+    UUIDs are kept unless they already belong to another user, in which case
+    the record gets a UUID derived from the user and the original UUID, so
+    that importing the same file again finds it. Documents and conversations
+    the user already has are not inserted again, and neither are the messages
+    such a conversation already has, so an interrupted import can be run
+    again. Every batch is added to the search index in the transaction that
+    inserts it.
+    """
+
+    def __init__(self, db: Session, user_id: int, upload_dir: str):
+        self.db = db
+        self.user_id = user_id
+        self.upload_dir = upload_dir
+        # Exported UUID -> row id, None for skipped records
+        self.document_ids: Dict[str, Optional[int]] = {}
+        self.conversation_ids: Dict[str, Optional[int]] = {}
+        # Keys of the messages of conversations the user already had (see
+        # _message_key), None until they are read
+        self.existing_messages: Dict[int, Optional[Set[tuple]]] = {}
+        self.documents: List[dict] = []
+        self.conversations: List[dict] = []
+        self.messages: List[dict] = []
+        self.stats = {
+            kind: {"imported": 0, "skipped": 0, "renamed": 0}
+            for kind in ("documents", "conversations")
+        }
+        self.stats["messages"] = {"imported": 0, "skipped": 0}
+
+    def _renamed_uuid(self, exported_uuid: str) -> str:
+        return str(uuid_pkg.uuid5(IMPORT_UUID_NAMESPACE, f"{self.user_id}:{exported_uuid}"))
+
+    def _existing(self, model, uuids: List[str]) -> Dict[str, tuple]:
+        return {
+            row.uuid: (row.id, row.user_id)
+            for row in self.db.query(model.uuid, model.id, model.user_id).filter(model.uuid.in_(uuids))
+        }
+
+    def _assign_uuids(self, model, records: List[dict], ids: Dict[str, Optional[int]], stats: dict) -> List[dict]:
+        """Map exported UUIDs to existing rows of the user or to the UUIDs the new rows get."""
+        for record in records:
+            record["renamed_uuid"] = self._renamed_uuid(record["uuid"])
+        existing = self._existing(model, [uuid for record in records for uuid in (record["uuid"], record["renamed_uuid"])])
+        new_records = []
+        for record in records:
+            found = existing.get(record["uuid"])
+            if found is None or found[1] != self.user_id:
+                # A record renamed by an earlier import
+                renamed = existing.get(record["renamed_uuid"])
+                if renamed is not None and renamed[1] == self.user_id:
+                    found = renamed
+            if found is not None and found[1] == self.user_id:
+                # Already imported; its conversations and messages still link to it
+                ids[record["uuid"]] = found[0]
+                stats["skipped"] += 1
+                if model is Conversation:
+                    self.existing_messages.setdefault(found[0], None)
+                continue
+            record["new_uuid"] = record["uuid"]
+            if found is not None:
+                record["new_uuid"] = record["renamed_uuid"]
+                stats["renamed"] += 1
+            new_records.append(record)
+        return new_records
+
+    def _insert(self, model, records: List[dict], rows: List[dict], ids: Dict[str, Optional[int]]):
+        """Insert rows and map the exported UUIDs to their ids, without committing."""
+        self.db.execute(insert(model), rows)
+        new_uuids = {record["new_uuid"]: record["uuid"] for record in records}
+        for new_uuid, row_id in self.db.query(model.uuid, model.id).filter(model.uuid.in_(list(new_uuids))):
+            ids[new_uuids[new_uuid]] = row_id
+
+    def add(self, record: dict):
+        kind = record.get("type")
+        if kind not in REQUIRED_FIELDS:
+            raise ImportFormatError(f"Unknown record type {kind!r}.")
+        missing = [name for name in REQUIRED_FIELDS[kind] if not isinstance(record.get(name), str)]
+        if missing:
+            raise ImportFormatError(f"The {kind} record lacks {', '.join(missing)}.")
+        if kind == "document":
+            if self.conversations or self.messages:
+                raise ImportFormatError("Documents must come before conversations and messages.")
+            self._stage_document(record)
+            if len(self.documents) >= IMPORT_DOCUMENT_BATCH_SIZE:
+                self.flush_documents()
+        elif kind == "conversation":
+            self.flush_documents()
+            self.conversations.append(record)
+            if len(self.conversations) >= IMPORT_BATCH_SIZE:
+                self.flush_conversations()
+        elif kind == "message":
+            self.flush_conversations()
+            self.messages.append(record)
+            if len(self.messages) >= IMPORT_BATCH_SIZE:
+                self.flush_messages()
+
+    def _stage_document(self, record: dict):
+        # The PDF is written to disk right away so that only the text stays buffered
+        pdf = record.pop("pdf", None)
+        if not pdf:
+            # Exported while its file was missing; its conversations are skipped too
+            self.document_ids[record["uuid"]] = None
+            self.stats["documents"]["skipped"] += 1
+            return
+        # Imported files are served like uploaded ones, so they pass the same checks
+        if not isinstance(pdf, str) or len(pdf) > MAX_PDF_BASE64_CHARS:
+            raise ImportFormatError(f"The PDF is too large. Max size is {MAX_FILE_SIZE // (1024 * 1024)}MB.")
+        content = base64.b64decode(pdf, validate=True)
+        if len(content) > MAX_FILE_SIZE:
+            raise ImportFormatError(f"The PDF is too large. Max size is {MAX_FILE_SIZE // (1024 * 1024)}MB.")
+        staged_path = os.path.join(self.upload_dir, f".import-{uuid_pkg.uuid4().hex}")
+        with open(staged_path, "wb") as f:
+            f.write(content)
+        try:
+            validate_pdf(staged_path, MAX_PDF_PAGES)
+        except IngestError as e:
+            discard(staged_path)
+            raise ImportFormatError(str(e))
+        record["sha256"] = content_sha256(content)
+        record["staged_path"] = staged_path
+        self.documents.append(record)
+
+    def discard_staged(self):
+        """Remove the files of documents that were read but not inserted."""
+        for record in self.documents:
+            if os.path.exists(record["staged_path"]):
+                os.remove(record["staged_path"])
+        self.documents = []
+
+    def flush_documents(self):
+        if not self.documents:
+            return
+        records, self.documents = self.documents, []
+        new_records = self._assign_uuids(Document, records, self.document_ids, self.stats["documents"])
+        rows = []
+        try:
+            for record in records:
+                if "new_uuid" not in record:
+                    os.remove(record["staged_path"])
+                    continue
+                file_path = os.path.join(self.upload_dir, f"{record['new_uuid']}_{os.path.basename(record['filename'])}")
+                os.replace(record["staged_path"], file_path)
+                record["staged_path"] = file_path
+                rows.append({
+                    "uuid": record["new_uuid"],
+                    "filename": record["filename"],
+                    "user_id": self.user_id,
+                    "extracted_text": record["extracted_text"],
+                    "page_offsets": base64.b64decode(record["page_offsets"]) if record.get("page_offsets") else None,
+                    "upload_date": _parse_timestamp(record.get("upload_date")),
+                    "file_path": file_path,
+                    "file_sha256": record["sha256"],
+                    "summary": record.get("summary"),
+                    "summary_generated_at": _parse_timestamp(record.get("summary_generated_at")),
+                })
+            if rows:
+                self._insert(Document, new_records, rows, self.document_ids)
+                self.db.commit()
+        except Exception:
+            self.db.rollback()
+            for record in new_records:
+                if os.path.exists(record["staged_path"]):
+                    os.remove(record["staged_path"])
+            raise
+        self.stats["documents"]["imported"] += len(rows)
+
+    def flush_conversations(self):
+        if not self.conversations:
+            return
+        records, self.conversations = self.conversations, []
+        stats = self.stats["conversations"]
+        # Conversations of documents that were not in the export are dropped
+        linked = []
+        for record in records:
+            if self.document_ids.get(record["document_uuid"]) is None:
+                self.conversation_ids[record["uuid"]] = None
+                stats["skipped"] += 1
+            else:
+                linked.append(record)
+        new_records = self._assign_uuids(Conversation, linked, self.conversation_ids, stats)
+        if not new_records:
+            return
+        rows = [
+            {
+                "uuid": record["new_uuid"],
+                "title": record["title"],
+                "user_id": self.user_id,
+                "document_id": self.document_ids[record["document_uuid"]],
+                "created_at": _parse_timestamp(record.get("created_at")),
+                "updated_at": _parse_timestamp(record.get("updated_at")),
+                "is_active": True,
+            }
+            for record in new_records
+        ]
+        self._insert(Conversation, new_records, rows, self.conversation_ids)
+        for record in new_records:
+            index_title(self.db, self.user_id, self.conversation_ids[record["uuid"]], record["title"])
+        self.db.commit()
+        stats["imported"] += len(rows)
+
+    def _load_existing_messages(self, conversation_ids: Set[int]):
+        """Read the keys of the messages of conversations the user already had, once per conversation."""
+        pending = [conversation_id for conversation_id in conversation_ids if self.existing_messages[conversation_id] is None]
+        if not pending:
+            return
+        for conversation_id in pending:
+            self.existing_messages[conversation_id] = set()
+        messages = (
+            self.db.query(ChatMessage.conversation_id, ChatMessage.role, ChatMessage.timestamp, ChatMessage.content)
+            .filter(ChatMessage.conversation_id.in_(pending))
+            .yield_per(EXPORT_FETCH_SIZE)
+        )
+        for message in messages:
+            self.existing_messages[message.conversation_id].add(_message_key(message.role, message.timestamp, message.content))
+
+    def flush_messages(self):
+        if not self.messages:
+            return
+        records, self.messages = self.messages, []
+        self._load_existing_messages({
+            self.conversation_ids[record["conversation_uuid"]] for record in records
+            if self.conversation_ids.get(record["conversation_uuid"]) in self.existing_messages
+        })
+        rows = []
+        for record in records:
+            conversation_id = self.conversation_ids.get(record["conversation_uuid"])
+            if conversation_id is None:
+                self.stats["messages"]["skipped"] += 1
+                continue
+            timestamp = _parse_timestamp(record.get("timestamp"))
+            existing = self.existing_messages.get(conversation_id)
+            if existing and _message_key(record["role"], timestamp, record["content"]) in existing:
+                self.stats["messages"]["skipped"] += 1
+                continue
+            rows.append({
+                "conversation_id": conversation_id,
+                "role": record["role"],
+                "content": record["content"],
+                "model": record.get("model"),
+                "timestamp": timestamp,
+            })
+        if rows:
+            last_id = self.db.query(func.max(ChatMessage.id)).scalar() or 0
+            self.db.execute(insert(ChatMessage), rows)
+            # Bulk inserts return no ids, so the new messages are read back to index them
+            inserted = (
+                self.db.query(ChatMessage.id, ChatMessage.conversation_id, ChatMessage.content)
+                .filter(ChatMessage.conversation_id.in_(list({row["conversation_id"] for row in rows})), ChatMessage.id > last_id)
+                .all()
+            )
+            index_messages(self.db, self.user_id, inserted)
+            self.db.commit()
+        self.stats["messages"]["imported"] += len(rows)
+
+    def finish(self) -> dict:
+        self.flush_documents()
+        self.flush_conversations()
+        self.flush_messages()
+        return self.stats
+
+
+def _read_lines(stream: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield the numbered lines of a decompressed export, reading at most MAX_IMPORT_LINE_BYTES at a time.
+
+    Raises:
+        ImportFormatError: If a line or the whole export is over its size limit.
+    """
+    total = 0
+    for line_number in itertools.count(1):
+        line = stream.readline(MAX_IMPORT_LINE_BYTES + 1)
+        if not line:
+            return
+        if len(line) > MAX_IMPORT_LINE_BYTES:
+            raise ImportFormatError(f"Line {line_number} is longer than {MAX_IMPORT_LINE_BYTES // (1024 * 1024)}MB.")
+        total += len(line)
+        if total > MAX_IMPORT_BYTES:
+            raise ImportFormatError(f"The export is larger than {MAX_IMPORT_BYTES // (1024 * 1024)}MB once decompressed.")
+        yield line_number, line
+
+
+def import_user_data(db: Session, user_id: int, stream: BinaryIO, upload_dir: str) -> dict:
+    """
+    Import an export, plain or gzipped, into a user's account.
+
+    The stream is read line by line and rows are bulk-inserted in batches,
+    each batch in its own transaction, so memory use does not depend on the
+    size of the export. Lines and the decompressed export are size-limited,
+    and PDFs pass the checks of an upload. The import is not atomic: if it fails, the batches
+    inserted so far are kept, and running it again skips them.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The user receiving the data.
+        stream (BinaryIO): The seekable export file.
+        upload_dir (str): Where the PDF files are written.
+
+    Returns:
+        dict: Imported, skipped and renamed counts per record type.
+
+    Raises:
+        ImportFormatError: If the file is not a valid export. Data imported before the invalid line is kept.
+    """
+    if stream.read(2) == GZIP_MAGIC:
+        stream.seek(0)
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    else:
+        stream.seek(0)
+
+    importer = _Importer(db, user_id, upload_dir)
+    try:
+        for line_number, line in _read_lines(stream):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ImportFormatError(f"Line {line_number} is not valid JSON.")
+            if not isinstance(record, dict):
+                raise ImportFormatError(f"Line {line_number} is not a JSON object.")
+            if line_number == 1:
+                if record.get("type") != "header" or record.get("version") != EXPORT_FORMAT_VERSION:
+                    raise ImportFormatError(f"Not an export of format version {EXPORT_FORMAT_VERSION}.")
+                continue
+            try:
+                importer.add(record)
+            except ImportFormatError as e:
+                raise ImportFormatError(f"Line {line_number}: {e}")
+            except (TypeError, ValueError):
+                # Malformed base64, timestamps or page offsets
+                raise ImportFormatError(f"Line {line_number} is not a valid {record['type']} record.")
+        return importer.finish()
+    except (gzip.BadGzipFile, EOFError, zlib.error) as e:
+        raise ImportFormatError(f"The file could not be read: {e}")
+    finally:
+        importer.discard_staged()
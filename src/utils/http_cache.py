@@ -0,0 +1,68 @@
+import hashlib
+from datetime import datetime, UTC
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+# Downloads are per-user, so shared caches must not store them, and browsers
+# revalidate on every open. A matching ETag turns the revalidation into a 304.
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_sha256(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """Hash a file in chunks without reading it into memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def strong_etag(sha256: str) -> str:
+    return f'"{sha256}"'
+
+
+def http_date(timestamp: float) -> str:
+    return format_datetime(datetime.fromtimestamp(timestamp, UTC), usegmt=True)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return any(
+        candidate == "*" or candidate.removeprefix("W/") == etag
+        for candidate in candidates
+    )
+
+
+def is_not_modified(headers, etag: str, last_modified: float) -> bool:
+    """
+    Evaluate the conditional GET headers of a request (RFC 9110, section 13.2.2).
+
+    Args:
+        headers: The request headers.
+        etag (str): The current strong ETag of the resource.
+        last_modified (float): The resource modification time as a Unix timestamp.
+
+    Returns:
+        bool: True if the client's copy is current and a 304 can be sent.
+    """
+    if_none_match: Optional[str] = headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=UTC)
+    # HTTP dates have one-second resolution
+    return int(last_modified) <= since.timestamp()
@@ -0,0 +1,28 @@
+import importlib
+from types import ModuleType
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    Used for heavy SDKs that most worker processes only need after the first
+    request, so they do not slow down start-up.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: ModuleType = None
+
+    def __getattr__(self, attribute: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
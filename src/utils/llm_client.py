@@ -1,14 +1,90 @@
+from __future__ import annotations
+
 import os
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv, find_dotenv
-from typing import List, Dict
+import re
+import json
+from functools import lru_cache
+from typing import List, Dict, Optional
+from loguru import logger
+from src.utils.admission import admitted
+from src.utils.lazy_import import lazy_import
+from src.utils.metrics import LLM_FALLBACKS, observe_llm_call
+from src.utils.model_routing import ANSWER, BATCH, CHAT, MULTI_DOCUMENT, SUMMARY, TITLE, Tier, model_policy
+from src.utils.profiling import span
+
+# The Gemini SDK takes about half a second to import, so it is loaded on the first LLM call
+genai = lazy_import("google.genai")
+types = lazy_import("google.genai.types")
 
-# Load environment variables from .env file
-load_dotenv(find_dotenv())
 
+@lru_cache(maxsize=4)
+def _get_client(api_key: str) -> genai.Client:
+    """
+    Return a Gemini client, reused across calls so connections are pooled.
 
-def get_llm_response(context: str, query: str) -> str:
+    Kept separate so benchmarks can substitute a fake backend.
+    """
+    return genai.Client(api_key=api_key)
+
+
+class LLMResponse(str):
+    """The text of an LLM response, carrying the model that produced it."""
+
+    def __new__(cls, text: str, model: str):
+        response = super().__new__(cls, text)
+        response.model = model
+        return response
+
+
+def _generate(helper: str, client: genai.Client, tier: Tier, contents: List[types.Content], config: types.GenerateContentConfig, input_chars: int) -> str:
+    """Stream one response from the model of ``tier`` and return the accumulated text."""
+    config = config.model_copy(update={"http_options": types.HttpOptions(timeout=int(tier.timeout_seconds * 1000))})
+    response_text = ""
+    with span(f"llm: {helper}"), observe_llm_call(helper, tier.model, input_chars) as call:
+        for chunk in client.models.generate_content_stream(
+            model=tier.model,
+            contents=contents,
+            config=config,
+        ):
+            call.on_chunk(chunk)
+            response_text += chunk.text
+    return response_text
+
+
+def _stream_response(helper: str, task: str, client: genai.Client, contents: List[types.Content], config: types.GenerateContentConfig) -> LLMResponse:
+    """
+    Stream a response from the Gemini API and return the accumulated text.
+
+    The model is chosen by the deployment's model policy from the task type and
+    prompt size. If it fails or times out, the call is retried from scratch on
+    the next model of the task.
+
+    Args:
+        helper (str): Name of the calling helper, used to label metrics.
+        task (str): The task type, see ``model_routing``.
+        client (genai.Client): The Gemini client.
+        contents (List[types.Content]): The conversation contents.
+        config (types.GenerateContentConfig): The generation config.
+
+    Returns:
+        LLMResponse: The full response text and the model that produced it.
+    """
+    input_chars = sum(len(part.text or "") for content in contents for part in content.parts)
+    input_chars += sum(len(part.text or "") for part in config.system_instruction or [])
+    tiers = model_policy().route(task, input_chars)
+
+    with admitted(input_chars):
+        for attempt, tier in enumerate(tiers, start=1):
+            try:
+                return LLMResponse(_generate(helper, client, tier, contents, config, input_chars), tier.model)
+            except Exception as e:
+                if attempt == len(tiers):
+                    raise
+                LLM_FALLBACKS.labels(helper=helper, model=tier.model).inc()
+                logger.warning(f"{helper}: {tier.model} failed ({type(e).__name__}: {e}), falling back to {tiers[attempt].model}")
+
+
+def get_llm_response(context: str, query: str) -> LLMResponse:
     """
     Send a context and query to the Google Gemini and return the response.
 
@@ -17,7 +93,7 @@ def get_llm_response(context: str, query: str) -> str:
         query (str): The query to ask the LLM.
 
     Returns:
-        str: The response from the LLM.
+        LLMResponse: The response from the LLM, with the model that produced it.
 
     Raises:
         Exception: If there is an error communicating with the LLM.
@@ -35,9 +111,8 @@ def get_llm_response(context: str, query: str) -> str:
         )
 
     # Initialize the Gemini client
-    client = genai.Client(api_key=API_KEY)
+    client = _get_client(API_KEY)
 
-    model = "gemini-2.0-flash"
     contents = [
         types.Content(
             role="user",
@@ -54,6 +129,7 @@ def get_llm_response(context: str, query: str) -> str:
                     "You will be given a context and a question. Your task is to generate a response that is relevant to the query based on the context provided. "
                     "If the context is insufficient to answer the question, you will respond with 'I do not have enough information to answer this question'. \n\n"
                     "If the context is empty, you will respond with 'I do not have any information to answer this question'. \n\n"
+                    "If the context contains [Page N] markers, cite the page numbers your answer is based on. \n\n"
                     "You should always respond in a friendly, helpful, and polite tone. \n\n"
                     "Your response should be in the following format: \n\n"
                     f"Context:\n```{context}``` \n\n"
@@ -62,18 +138,9 @@ def get_llm_response(context: str, query: str) -> str:
         ],
     )
 
-    # Stream and accumulate the response
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        response_text += chunk.text
+    return _stream_response("get_llm_response", ANSWER, client, contents, generate_content_config)
 
-    return response_text
-
-def get_chat_response(context: str, conversation_history: List[Dict[str, str]], new_query: str) -> str:
+def get_chat_response(context: str, conversation_history: List[Dict[str, str]], new_query: str) -> LLMResponse:
     """
     Get a chat response considering conversation history.
     
@@ -83,14 +150,13 @@ def get_chat_response(context: str, conversation_history: List[Dict[str, str]],
         new_query (str): The new user query
     
     Returns:
-        str: The LLM response
+        LLMResponse: The LLM response, with the model that produced it
     """
     API_KEY = os.environ.get("GEMINI_API_KEY")
     if not API_KEY:
         raise ValueError("GEMINI_API_KEY is not set in the .env file.")
 
-    client = genai.Client(api_key=API_KEY)
-    model = "gemini-2.0-flash"
+    client = _get_client(API_KEY)
     
     # Build conversation contents
     contents = []
@@ -124,6 +190,7 @@ def get_chat_response(context: str, conversation_history: List[Dict[str, str]],
                     "Answer questions based on the document context and conversation history. "
                     "If you need to clarify something from earlier in the conversation, feel free to reference it. "
                     "Keep your responses conversational and engaging while being accurate to the document content. \n\n"
+                    "If the context contains [Page N] markers, cite the page numbers your answer is based on. \n\n"
                     "If the context is insufficient to answer the question, you will respond with 'I do not have enough information from the document to answer this question'. \n\n"
                     "Document Context:\n```{context}``` \n\n".format(context=context)
                 )
@@ -131,15 +198,7 @@ def get_chat_response(context: str, conversation_history: List[Dict[str, str]],
         ],
     )
 
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        response_text += chunk.text
-
-    return response_text
+    return _stream_response("get_chat_response", CHAT, client, contents, generate_content_config)
 
 
 def generate_document_summary(context: str, filename: str) -> str:
@@ -157,8 +216,7 @@ def generate_document_summary(context: str, filename: str) -> str:
     if not API_KEY:
         raise ValueError("GEMINI_API_KEY is not set in the .env file.")
 
-    client = genai.Client(api_key=API_KEY)
-    model = "gemini-2.0-flash"
+    client = _get_client(API_KEY)
     
     summary_prompt = f"""Please provide a comprehensive summary of the document "{filename}". 
     Your summary should include:
@@ -195,15 +253,33 @@ def generate_document_summary(context: str, filename: str) -> str:
         ],
     )
 
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        response_text += chunk.text
+    return _stream_response("generate_document_summary", SUMMARY, client, contents, generate_content_config)
 
-    return response_text
+
+def quick_conversation_title(first_query: str, max_words: int = 8) -> str:
+    """
+    Build a conversation title locally from the first query, without calling the LLM.
+
+    Args:
+        first_query (str): The first user query in the conversation
+        max_words (int): Maximum number of words to keep
+
+    Returns:
+        str: A short title for the conversation
+    """
+    text = " ".join(first_query.split())
+    # Keep the first sentence only
+    match = re.search(r"[.?!](\s|$)", text)
+    if match:
+        text = text[:match.start()]
+    words = text.split()
+    title = " ".join(words[:max_words]).strip(" ,;:-")
+    if len(words) > max_words:
+        title += "..."
+    if not title:
+        return "New conversation"
+    title = title[0].upper() + title[1:]
+    return title[:100]
 
 
 def generate_conversation_title(first_query: str) -> str:
@@ -218,11 +294,10 @@ def generate_conversation_title(first_query: str) -> str:
     """
     API_KEY = os.environ.get("GEMINI_API_KEY")
     if not API_KEY:
-        return f"Chat about: {first_query[:50]}..." if len(first_query) > 50 else f"Chat about: {first_query}"
+        return quick_conversation_title(first_query)
 
     try:
-        client = genai.Client(api_key=API_KEY)
-        model = "gemini-2.0-flash"
+        client = _get_client(API_KEY)
         
         title_prompt = f"Generate a short, descriptive title (maximum 8 words) for a conversation that starts with this question: '{first_query}'. Return only the title, nothing else."
         
@@ -237,13 +312,7 @@ def generate_conversation_title(first_query: str) -> str:
             response_mime_type="text/plain",
         )
 
-        response_text = ""
-        for chunk in client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            response_text += chunk.text
+        response_text = _stream_response("generate_conversation_title", TITLE, client, contents, generate_content_config)
 
         # Clean up the response and limit length
         title = response_text.strip().replace('"', '').replace("'", "")
@@ -251,4 +320,151 @@ def generate_conversation_title(first_query: str) -> str:
         
     except Exception:
         # Fallback to simple title generation
-        return f"Chat about: {first_query[:50]}..." if len(first_query) > 50 else f"Chat about: {first_query}"
\ No newline at end of file
+        return quick_conversation_title(first_query)
+
+MULTI_DOCUMENT_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "answer": {"type": "STRING"},
+        "sources": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "document_uuid": {"type": "STRING"},
+                    "pages": {"type": "ARRAY", "items": {"type": "INTEGER"}},
+                    "contribution": {"type": "STRING"},
+                },
+                "required": ["document_uuid", "contribution"],
+            },
+        },
+    },
+    "required": ["answer", "sources"],
+}
+
+
+def get_multi_document_response(context: str, query: str) -> LLMResponse:
+    """
+    Answer a query from passages of several documents, with per-document attribution.
+
+    Args:
+        context (str): Passages labelled with their document UUID, filename and page
+        query (str): The user query
+
+    Returns:
+        LLMResponse: A JSON object with an ``answer`` and a list of ``sources``, each naming a
+        ``document_uuid``, the ``pages`` used and the document's ``contribution``
+    """
+    API_KEY = os.environ.get("GEMINI_API_KEY")
+    if not API_KEY:
+        raise ValueError("GEMINI_API_KEY is not set in the .env file.")
+
+    client = _get_client(API_KEY)
+
+    contents = [
+        types.Content(
+            role="user",
+            parts=[types.Part.from_text(text=query)],
+        ),
+    ]
+
+    generate_content_config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=MULTI_DOCUMENT_RESPONSE_SCHEMA,
+        system_instruction=[
+            types.Part.from_text(
+                text=(
+                    "You are a helpful assistant that answers questions across several documents. "
+                    "The context below, delimited with triple backticks, contains passages. Each passage starts with a label "
+                    "naming its document UUID, filename and, when known, its page. \n\n"
+                    "Answer the question using only these passages. When documents differ, compare them explicitly. "
+                    "In 'sources', list every document you used with its document_uuid exactly as given in the labels, "
+                    "the pages you relied on and a short description of what that document contributed. "
+                    "If the passages are insufficient, say 'I do not have enough information to answer this question' in the answer "
+                    "and return an empty list of sources. \n\n"
+                    "Passages:\n```{context}``` \n\n".format(context=context)
+                )
+            ),
+        ],
+    )
+
+    return _stream_response("get_multi_document_response", MULTI_DOCUMENT, client, contents, generate_content_config)
+
+
+BATCH_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "answers": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "index": {"type": "INTEGER"},
+                    "answer": {"type": "STRING"},
+                },
+                "required": ["index", "answer"],
+            },
+        },
+    },
+    "required": ["answers"],
+}
+
+
+def get_batch_llm_response(context: str, questions: List[str]) -> List[Optional[str]]:
+    """
+    Answer several questions about the same context in a single LLM call.
+
+    Args:
+        context (str): The document context shared by all questions
+        questions (List[str]): The questions to answer
+
+    Returns:
+        List[Optional[str]]: One answer per question, in order. None when the LLM
+        returned no answer for that question.
+
+    Raises:
+        ValueError: If the GEMINI_API_KEY is not set or the response is not valid JSON.
+    """
+    API_KEY = os.environ.get("GEMINI_API_KEY")
+    if not API_KEY:
+        raise ValueError("GEMINI_API_KEY is not set in the .env file.")
+
+    client = _get_client(API_KEY)
+
+    numbered_questions = "\n".join(f"{index}. {question}" for index, question in enumerate(questions))
+    contents = [
+        types.Content(
+            role="user",
+            parts=[types.Part.from_text(text=f"Answer each of these questions:\n{numbered_questions}")],
+        ),
+    ]
+
+    generate_content_config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=BATCH_RESPONSE_SCHEMA,
+        system_instruction=[
+            types.Part.from_text(
+                text=(
+                    "You are a helpful assistant that answers questions based on the provided context delimited with triple backticks. \n\n"
+                    "You will be given a numbered list of questions. Answer every question independently, based only on the context, "
+                    "and return one entry per question in 'answers' with the question's number as 'index'. "
+                    "If the context is insufficient to answer a question, answer it with 'I do not have enough information to answer this question'. \n\n"
+                    "If the context contains [Page N] markers, cite the page numbers each answer is based on. \n\n"
+                    f"Context:\n```{context}``` \n\n"
+                )
+            ),
+        ],
+    )
+
+    response_text = _stream_response("get_batch_llm_response", BATCH, client, contents, generate_content_config)
+    try:
+        entries = json.loads(response_text)["answers"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("The LLM returned an invalid batch response.")
+
+    answers: List[Optional[str]] = [None] * len(questions)
+    for entry in entries:
+        index = entry.get("index") if isinstance(entry, dict) else None
+        if isinstance(index, int) and 0 <= index < len(questions):
+            answers[index] = entry.get("answer")
+    return answers
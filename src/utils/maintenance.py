@@ -0,0 +1,372 @@
+"""
+Database and upload directory maintenance.
+
+Purges conversations that were deleted more than CONVERSATION_RETENTION_DAYS
+ago, deletes upload files no document refers to and analyzes (and, when
+fragmented, vacuums) the database. It runs in a background thread every
+MAINTENANCE_INTERVAL_HOURS, or once from the command line:
+
+    python -m src.utils.maintenance run --dry-run
+
+A cross-process lock makes sure that only one pass runs at a time, whatever
+the number of application workers and cron jobs.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, UTC
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from loguru import logger
+from sqlalchemy import and_, func, text
+
+from src.config import UPLOAD_DIR
+from src.db import SessionLocal, engine
+from src.models import ChatMessage, Conversation, Document
+from src.utils.metrics import (
+    MAINTENANCE_DELETED_FILES,
+    MAINTENANCE_DELETED_ROWS,
+    MAINTENANCE_LAST_SUCCESS,
+    MAINTENANCE_PENDING_CONVERSATIONS,
+)
+from src.utils.search_index import SEARCH_TABLE, optimize_search_index, remove_messages, remove_titles
+
+# 0 disables the background worker; run the CLI from cron instead
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get("MAINTENANCE_INTERVAL_HOURS", "0"))
+CONVERSATION_RETENTION_DAYS = float(os.environ.get("CONVERSATION_RETENTION_DAYS", "30"))
+# When set, purged conversations are appended to gzipped JSON lines files in this directory first
+MAINTENANCE_ARCHIVE_DIR = os.environ.get("MAINTENANCE_ARCHIVE_DIR")
+# Messages deleted per transaction, so that no lock is held for long
+MAINTENANCE_BATCH_SIZE = int(os.environ.get("MAINTENANCE_BATCH_SIZE", "500"))
+MAINTENANCE_PAUSE = float(os.environ.get("MAINTENANCE_PAUSE", "0.05"))
+# Files younger than this may belong to an upload whose row is not committed yet
+ORPHAN_FILE_GRACE_HOURS = float(os.environ.get("ORPHAN_FILE_GRACE_HOURS", "1"))
+# SQLite is vacuumed when at least this share of its pages is free
+VACUUM_FREE_RATIO = float(os.environ.get("VACUUM_FREE_RATIO", "0.25"))
+CONVERSATIONS_PER_BATCH = 50
+# SQLite passes are serialized with a lock file, by default next to the database
+MAINTENANCE_LOCK_FILE = os.environ.get("MAINTENANCE_LOCK_FILE")
+# MySQL passes hold a named lock, which is released if the connection is lost
+MAINTENANCE_LOCK_NAME = "cag_maintenance"
+
+
+def _lock_file_path() -> str:
+    if MAINTENANCE_LOCK_FILE:
+        return MAINTENANCE_LOCK_FILE
+    database = engine.url.database
+    if not database or database == ":memory:":
+        return os.path.join(tempfile.gettempdir(), "cag-maintenance.lock")
+    return f"{database}.maintenance.lock"
+
+
+def _try_lock_file(lock_file) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+@contextmanager
+def maintenance_lock() -> Iterator[bool]:
+    """
+    Take the maintenance lock for the duration of the block, without waiting for it.
+
+    The lock is shared by every process using the database: a lock file for
+    SQLite, a named lock (GET_LOCK) for MySQL. Both are released by the
+    operating system or the server if the process dies.
+
+    Yields:
+        bool: Whether the lock was taken. If not, another pass is running.
+    """
+    if engine.dialect.name == "sqlite":
+        with open(_lock_file_path(), "a+") as lock_file:
+            # Unlocked when the file is closed
+            yield _try_lock_file(lock_file)
+    else:
+        with engine.connect() as conn:
+            acquired = conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": MAINTENANCE_LOCK_NAME}).scalar() == 1
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MAINTENANCE_LOCK_NAME})
+
+
+def expired_conversations(retention_days: float):
+    """Filter matching soft-deleted conversations past the retention period."""
+    cutoff = datetime.now(UTC) - timedelta(days=retention_days)
+    # Conversations deleted before deleted_at existed fall back to their last update
+    return and_(
+        Conversation.is_active.is_(False),
+        func.coalesce(Conversation.deleted_at, Conversation.updated_at) < cutoff,
+    )
+
+
+def _archive_path(archive_dir: str) -> str:
+    os.makedirs(archive_dir, exist_ok=True)
+    return os.path.join(archive_dir, f"conversations-{datetime.now(UTC):%Y%m%d}.jsonl.gz")
+
+
+def _write_records(archive, records):
+    for record in records:
+        archive.write(json.dumps(record, default=str) + "\n")
+    # Flushed before the rows are deleted, so nothing is purged that was not archived
+    archive.flush()
+
+
+def purge_conversations(
+    retention_days: float = CONVERSATION_RETENTION_DAYS,
+    batch_size: int = MAINTENANCE_BATCH_SIZE,
+    pause: float = MAINTENANCE_PAUSE,
+    archive_dir: Optional[str] = MAINTENANCE_ARCHIVE_DIR,
+    dry_run: bool = False,
+    stop: Optional[threading.Event] = None,
+) -> dict:
+    """
+    Delete expired conversations with their messages and search index entries.
+
+    Messages are deleted ``batch_size`` at a time, each batch in its own short
+    transaction, so a large purge never blocks the live tables for long. The
+    purge can be interrupted and resumed at any time.
+
+    Args:
+        retention_days (float): Days a deleted conversation is kept.
+        batch_size (int): Messages deleted per transaction.
+        pause (float): Seconds to sleep between transactions, to limit load on a live database.
+        archive_dir (Optional[str]): Archive conversations and messages here before deleting them.
+        dry_run (bool): Only count what would be purged.
+        stop (Optional[threading.Event]): Stop after the current batch once set.
+
+    Returns:
+        dict: Conversations and messages purged (or found, for a dry run).
+    """
+    expired = expired_conversations(retention_days)
+    stats = {"conversations": 0, "messages": 0}
+    with SessionLocal() as db:
+        pending = db.query(func.count(Conversation.id)).filter(expired).scalar()
+        if dry_run:
+            stats["conversations"] = pending
+            stats["messages"] = (
+                db.query(func.count(ChatMessage.id))
+                .join(Conversation, Conversation.id == ChatMessage.conversation_id)
+                .filter(expired)
+                .scalar()
+            )
+            return stats
+    MAINTENANCE_PENDING_CONVERSATIONS.set(pending)
+    logger.info(f"Maintenance: {pending} conversations to purge")
+
+    archive = gzip.open(_archive_path(archive_dir), "at", encoding="utf-8") if archive_dir else None
+    try:
+        last_id = 0
+        while not (stop and stop.is_set()):
+            with SessionLocal() as db:
+                conversations = (
+                    db.query(
+                        Conversation.id, Conversation.uuid, Conversation.user_id, Conversation.document_id,
+                        Conversation.title, Conversation.created_at, Conversation.updated_at, Conversation.deleted_at,
+                    )
+                    .filter(expired, Conversation.id > last_id)
+                    .order_by(Conversation.id)
+                    .limit(CONVERSATIONS_PER_BATCH)
+                    .all()
+                )
+            if not conversations:
+                break
+            last_id = conversations[-1].id
+            conversation_ids = [conversation.id for conversation in conversations]
+            if archive:
+                _write_records(archive, ({"type": "conversation", **conversation._asdict()} for conversation in conversations))
+
+            while not (stop and stop.is_set()):
+                with SessionLocal() as db:
+                    columns = (ChatMessage.id, ChatMessage.conversation_id, ChatMessage.role, ChatMessage.content, ChatMessage.model, ChatMessage.timestamp)
+                    messages = (
+                        db.query(*(columns if archive else columns[:1]))
+                        .filter(ChatMessage.conversation_id.in_(conversation_ids))
+                        .order_by(ChatMessage.id)
+                        .limit(batch_size)
+                        .all()
+                    )
+                    if not messages:
+                        break
+                    if archive:
+                        _write_records(archive, ({"type": "message", **message._asdict()} for message in messages))
+                    message_ids = [message.id for message in messages]
+                    remove_messages(db, message_ids)
+                    db.query(ChatMessage).filter(ChatMessage.id.in_(message_ids)).delete(synchronize_session=False)
+                    db.commit()
+                stats["messages"] += len(message_ids)
+                MAINTENANCE_DELETED_ROWS.labels(table="chat_messages").inc(len(message_ids))
+                if pause:
+                    time.sleep(pause)
+            if stop and stop.is_set():
+                break
+
+            with SessionLocal() as db:
+                remove_titles(db, conversation_ids)
+                deleted = (
+                    db.query(Conversation)
+                    .filter(Conversation.id.in_(conversation_ids), expired)
+                    .delete(synchronize_session=False)
+                )
+                db.commit()
+            stats["conversations"] += deleted
+            MAINTENANCE_DELETED_ROWS.labels(table="conversations").inc(deleted)
+            MAINTENANCE_PENDING_CONVERSATIONS.set(max(0, pending - stats["conversations"]))
+            logger.info(
+                f"Maintenance: purged {stats['conversations']}/{pending} conversations, {stats['messages']} messages"
+            )
+    finally:
+        if archive:
+            archive.close()
+        MAINTENANCE_PENDING_CONVERSATIONS.set(0)
+    return stats
+
+
+def delete_orphaned_files(
+    upload_dir: str = UPLOAD_DIR,
+    grace_hours: float = ORPHAN_FILE_GRACE_HOURS,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Delete files in the upload directory that no document refers to.
+
+    Returns:
+        dict: Files scanned, files deleted (or found, for a dry run) and bytes freed.
+    """
+    with SessionLocal() as db:
+        referenced = {os.path.realpath(path) for (path,) in db.query(Document.file_path).yield_per(1000)}
+    cutoff = time.time() - grace_hours * 3600
+    stats = {"scanned": 0, "deleted": 0, "bytes": 0}
+    if not os.path.isdir(upload_dir):
+        return stats
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stats["scanned"] += 1
+            if os.path.realpath(entry.path) in referenced:
+                continue
+            stat_result = entry.stat()
+            if stat_result.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                MAINTENANCE_DELETED_FILES.inc()
+            stats["deleted"] += 1
+            stats["bytes"] += stat_result.st_size
+    logger.info(f"Maintenance: {stats['deleted']} orphaned files ({stats['bytes']} bytes) of {stats['scanned']} in {upload_dir}")
+    return stats
+
+
+def optimize_database(vacuum_free_ratio: float = VACUUM_FREE_RATIO) -> dict:
+    """
+    Refresh the query planner statistics and reclaim free space.
+
+    SQLite is vacuumed only when enough pages are free, as VACUUM rewrites the
+    whole file and blocks writers meanwhile. MySQL tables are analyzed; InnoDB
+    reuses the freed pages itself.
+
+    Returns:
+        dict: What was done.
+    """
+    stats = {"analyzed": True, "vacuumed": False}
+    if engine.dialect.name == "sqlite":
+        optimize_search_index(engine)
+        with engine.connect() as conn:
+            page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+            free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        if page_count and free_pages / page_count >= vacuum_free_ratio:
+            # VACUUM cannot run inside a transaction
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.exec_driver_sql("VACUUM")
+            stats["vacuumed"] = True
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"ANALYZE TABLE conversations, chat_messages, documents, {SEARCH_TABLE}"))
+    logger.info(f"Maintenance: database optimized {stats}")
+    return stats
+
+
+def run_maintenance(dry_run: bool = False, stop: Optional[threading.Event] = None) -> dict:
+    """Run one full maintenance pass and return the report of every step, unless another pass is running."""
+    with maintenance_lock() as acquired:
+        if not acquired:
+            logger.info("Maintenance: another pass is running, skipping this one")
+            return {"skipped": {"reason": "another maintenance pass is running"}}
+        started = time.perf_counter()
+        report = {"conversations": purge_conversations(dry_run=dry_run, stop=stop)}
+        if stop and stop.is_set():
+            return report
+        report["files"] = delete_orphaned_files(dry_run=dry_run)
+        if not dry_run:
+            report["database"] = optimize_database()
+            MAINTENANCE_LAST_SUCCESS.set_to_current_time()
+        logger.info(f"Maintenance pass finished in {time.perf_counter() - started:.1f}s: {report}")
+        return report
+
+
+class MaintenanceWorker(threading.Thread):
+    """Runs a maintenance pass every ``interval_hours`` until stopped."""
+
+    def __init__(self, interval_hours: float):
+        super().__init__(name="maintenance", daemon=True)
+        self.interval = interval_hours * 3600
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                run_maintenance(stop=self._stop_event)
+            except Exception:
+                logger.exception("Maintenance pass failed")
+
+    def stop(self, timeout: float = 10):
+        """Ask the worker to stop after its current batch and wait for it."""
+        self._stop_event.set()
+        self.join(timeout)
+
+
+def start_maintenance_worker() -> Optional[MaintenanceWorker]:
+    """Start the background worker if MAINTENANCE_INTERVAL_HOURS is set."""
+    if MAINTENANCE_INTERVAL_HOURS <= 0:
+        return None
+    worker = MaintenanceWorker(MAINTENANCE_INTERVAL_HOURS)
+    worker.start()
+    logger.info(f"Maintenance worker started, running every {MAINTENANCE_INTERVAL_HOURS}h")
+    return worker
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge expired conversations and orphaned files, then optimize the database.")
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted.")
+    args = parser.parse_args()
+
+    from src.db import init_db
+
+    init_db()
+    for step, stats in run_maintenance(dry_run=args.dry_run).items():
+        print(f"{step}: {stats}")
@@ -0,0 +1,261 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from sqlalchemy import event
+
+# Buckets tuned for LLM calls, which take seconds rather than milliseconds
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ["method", "route", "status"],
+)
+
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds",
+    "Total duration of an LLM call, including streaming.",
+    ["helper", "model"],
+    buckets=LLM_BUCKETS,
+)
+LLM_TIME_TO_FIRST_CHUNK = Histogram(
+    "llm_time_to_first_chunk_seconds",
+    "Time until the first streamed chunk of an LLM response arrives.",
+    ["helper", "model"],
+    buckets=LLM_BUCKETS,
+)
+LLM_INPUT_CHARACTERS = Counter(
+    "llm_input_characters_total",
+    "Characters sent to the LLM (prompt, history and system instruction).",
+    ["helper"],
+)
+LLM_OUTPUT_CHARACTERS = Counter(
+    "llm_output_characters_total",
+    "Characters received from the LLM.",
+    ["helper"],
+)
+LLM_INPUT_TOKENS = Counter(
+    "llm_input_tokens_total",
+    "Prompt tokens reported by the LLM usage metadata.",
+    ["helper"],
+)
+LLM_OUTPUT_TOKENS = Counter(
+    "llm_output_tokens_total",
+    "Response tokens reported by the LLM usage metadata.",
+    ["helper"],
+)
+LLM_ERRORS = Counter(
+    "llm_errors_total",
+    "LLM calls that raised an error.",
+    ["helper", "error"],
+)
+LLM_FALLBACKS = Counter(
+    "llm_fallbacks_total",
+    "LLM calls retried on the next model after the routed model failed.",
+    ["helper", "model"],
+)
+
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "LLM calls waiting for admission.",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+LLM_ACTIVE_CALLS = Gauge(
+    "llm_active_calls",
+    "LLM calls currently admitted.",
+    multiprocess_mode="livesum",
+)
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time an admitted LLM call waited in the admission queue.",
+    ["priority"],
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60),
+)
+LLM_ADMISSION_REJECTIONS = Counter(
+    "llm_admission_rejections_total",
+    "LLM calls rejected by admission control.",
+    ["priority", "reason"],
+)
+
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Duration of individual SQL statements.",
+    ["operation"],
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "Number of SQL statements executed while handling a request.",
+    ["route"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds",
+    "Total time spent in SQL statements while handling a request.",
+    ["route"],
+)
+
+PDF_PAGE_EXTRACTION_DURATION = Histogram(
+    "pdf_page_extraction_seconds",
+    "Time to extract the text of a single PDF page.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+PDF_PAGES_EXTRACTED = Counter(
+    "pdf_pages_extracted_total",
+    "PDF pages whose text was extracted.",
+)
+
+MAINTENANCE_DELETED_ROWS = Counter(
+    "maintenance_deleted_rows_total",
+    "Rows purged by the maintenance worker.",
+    ["table"],
+)
+MAINTENANCE_DELETED_FILES = Counter(
+    "maintenance_deleted_files_total",
+    "Unreferenced upload files deleted by the maintenance worker.",
+)
+MAINTENANCE_PENDING_CONVERSATIONS = Gauge(
+    "maintenance_pending_conversations",
+    "Expired conversations still to be purged by the running maintenance pass.",
+    multiprocess_mode="livemax",
+)
+MAINTENANCE_LAST_SUCCESS = Gauge(
+    "maintenance_last_success_timestamp_seconds",
+    "Unix time the last maintenance pass completed.",
+    multiprocess_mode="max",
+)
+
+
+class RequestDBStats:
+    """Mutable per-request SQL counters, shared with worker threads through a context variable."""
+
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+_request_db_stats: ContextVar[Optional[RequestDBStats]] = ContextVar("request_db_stats", default=None)
+
+
+def start_request_db_stats() -> RequestDBStats:
+    """Start collecting SQL statistics for the current request."""
+    stats = RequestDBStats()
+    _request_db_stats.set(stats)
+    return stats
+
+
+def route_template(scope) -> str:
+    """
+    Return the matched route template (e.g. ``/api/v1/query/{uuid}``) for a request.
+
+    Raw paths are never used as labels so that metric cardinality stays bounded.
+    """
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    # Recent FastAPI versions match the routes of an included router without its
+    # prefix, and record the full path alongside
+    effective_route = scope.get("fastapi", {}).get("effective_route_context")
+    return getattr(effective_route, "path", None) or getattr(route, "path", "unmatched")
+
+
+def instrument_engine(engine):
+    """Record the count and duration of every statement executed on ``engine``."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_QUERY_DURATION.labels(operation=operation).observe(elapsed)
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+
+class LLMCallObserver:
+    """Collects timing and size information while an LLM response is streamed."""
+
+    def __init__(self, helper: str, model: str):
+        self.helper = helper
+        self.model = model
+        self.started = time.perf_counter()
+        self.first_chunk_at: Optional[float] = None
+        self.output_chars = 0
+        self.usage = None
+
+    def on_chunk(self, chunk):
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter()
+            LLM_TIME_TO_FIRST_CHUNK.labels(helper=self.helper, model=self.model).observe(
+                self.first_chunk_at - self.started
+            )
+        self.output_chars += len(chunk.text or "")
+        # Usage metadata is cumulative, so the last chunk carrying it wins
+        if getattr(chunk, "usage_metadata", None) is not None:
+            self.usage = chunk.usage_metadata
+
+
+@contextmanager
+def observe_llm_call(helper: str, model: str, input_chars: int):
+    """
+    Record metrics for one LLM call.
+
+    Args:
+        helper (str): Name of the ``llm_client`` helper making the call.
+        model (str): The model being called.
+        input_chars (int): Characters sent in the request.
+
+    Yields:
+        LLMCallObserver: Call ``on_chunk`` for every streamed chunk.
+    """
+    observer = LLMCallObserver(helper, model)
+    LLM_INPUT_CHARACTERS.labels(helper=helper).inc(input_chars)
+    try:
+        yield observer
+    except Exception as e:
+        LLM_ERRORS.labels(helper=helper, error=type(e).__name__).inc()
+        raise
+    finally:
+        LLM_REQUEST_DURATION.labels(helper=helper, model=model).observe(time.perf_counter() - observer.started)
+        LLM_OUTPUT_CHARACTERS.labels(helper=helper).inc(observer.output_chars)
+        if observer.usage is not None:
+            LLM_INPUT_TOKENS.labels(helper=helper).inc(observer.usage.prompt_token_count or 0)
+            LLM_OUTPUT_TOKENS.labels(helper=helper).inc(observer.usage.candidates_token_count or 0)
+
+
+def render_metrics():
+    """
+    Render all metrics in the Prometheus text format.
+
+    When ``PROMETHEUS_MULTIPROC_DIR`` is set (several uvicorn/gunicorn workers),
+    the samples of every worker process are aggregated.
+
+    Returns:
+        tuple: The payload and its content type.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,106 @@
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+# JSON file overriding the default policy below, see the README
+MODEL_POLICY_FILE = os.environ.get("MODEL_POLICY_FILE")
+
+# Task types of the llm_client helpers
+TITLE = "title"
+ANSWER = "answer"
+CHAT = "chat"
+MULTI_DOCUMENT = "multi_document"
+BATCH = "batch"
+SUMMARY = "summary"
+
+DEFAULT_POLICY = {
+    # max_input_chars is the largest prompt routed to a tier (null for no limit)
+    "tiers": {
+        "small": {"model": "gemini-2.0-flash-lite", "max_input_chars": 40_000, "timeout_seconds": 30},
+        "standard": {"model": "gemini-2.0-flash", "max_input_chars": 3_000_000, "timeout_seconds": 120},
+        "long_context": {"model": "gemini-2.5-pro", "max_input_chars": None, "timeout_seconds": 300},
+    },
+    # Tiers tried in order for each task, skipping those too small for the prompt
+    "tasks": {
+        TITLE: ["small", "standard"],
+        ANSWER: ["small", "standard", "long_context"],
+        CHAT: ["small", "standard", "long_context"],
+        MULTI_DOCUMENT: ["standard", "long_context"],
+        BATCH: ["standard", "long_context"],
+        SUMMARY: ["standard", "long_context"],
+    },
+}
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    model: str
+    max_input_chars: Optional[int]
+    timeout_seconds: float
+
+    def fits(self, input_chars: int) -> bool:
+        return self.max_input_chars is None or input_chars <= self.max_input_chars
+
+
+@dataclass(frozen=True)
+class ModelPolicy:
+    tiers: Dict[str, Tier]
+    tasks: Dict[str, List[Tier]]
+
+    def route(self, task: str, input_chars: int) -> List[Tier]:
+        """
+        Choose the models for one call.
+
+        Args:
+            task (str): The task type, e.g. TITLE or SUMMARY.
+            input_chars (int): Size of the prompt, including history and system instruction.
+
+        Returns:
+            List[Tier]: The tier to call first, followed by the fallbacks to try if it fails.
+        """
+        candidates = self.tasks[task]
+        fitting = [tier for tier in candidates if tier.fits(input_chars)]
+        # Nothing is large enough: try the last tier anyway and let the API decide
+        return fitting or candidates[-1:]
+
+
+def parse_policy(data: dict) -> ModelPolicy:
+    """
+    Build a policy from its JSON form, on top of the defaults.
+
+    Tiers and tasks given in ``data`` replace the default entry of the same name.
+
+    Raises:
+        ValueError: If a tier is incomplete or a task names an unknown tier.
+    """
+    tier_specs = {**DEFAULT_POLICY["tiers"], **data.get("tiers", {})}
+    task_specs = {**DEFAULT_POLICY["tasks"], **data.get("tasks", {})}
+    tiers = {}
+    for name, spec in tier_specs.items():
+        if not spec.get("model"):
+            raise ValueError(f"Model policy tier '{name}' has no model.")
+        tiers[name] = Tier(
+            name=name,
+            model=spec["model"],
+            max_input_chars=spec.get("max_input_chars"),
+            timeout_seconds=float(spec.get("timeout_seconds", 120)),
+        )
+    tasks = {}
+    for task, names in task_specs.items():
+        unknown = [name for name in names if name not in tiers]
+        if unknown or not names:
+            raise ValueError(f"Model policy task '{task}' must list known tiers, got {names}.")
+        tasks[task] = [tiers[name] for name in names]
+    return ModelPolicy(tiers=tiers, tasks=tasks)
+
+
+@lru_cache(maxsize=1)
+def model_policy() -> ModelPolicy:
+    """The deployment's policy, read from MODEL_POLICY_FILE once per process."""
+    if not MODEL_POLICY_FILE:
+        return parse_policy({})
+    with open(MODEL_POLICY_FILE, encoding="utf-8") as f:
+        return parse_policy(json.load(f))
@@ -0,0 +1,139 @@
+import sys
+from array import array
+from typing import List, Optional, Tuple
+
+# Pages are joined with this separator when stored in Document.extracted_text
+PAGE_SEPARATOR = "\n"
+# Separator used when an update appends a new PDF to an existing document
+UPDATE_SEPARATOR = "\n\n"
+# Offsets are stored as little-endian unsigned 32-bit integers
+OFFSET_TYPECODE = "I"
+
+
+def _to_bytes(offsets: array) -> bytes:
+    if sys.byteorder == "big":
+        offsets = array(OFFSET_TYPECODE, offsets)
+        offsets.byteswap()
+    return offsets.tobytes()
+
+
+def load_page_offsets(blob: bytes) -> array:
+    """
+    Decode a stored page index.
+
+    The index holds a ``(start, end)`` pair of offsets into the document text
+    for every page, so page ``n`` (1-based) spans
+    ``text[offsets[2 * n - 2]:offsets[2 * n - 1]]``.
+
+    Args:
+        blob (bytes): The raw ``Document.page_offsets`` value.
+
+    Returns:
+        array: The decoded offsets.
+    """
+    offsets = array(OFFSET_TYPECODE)
+    offsets.frombytes(blob)
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return offsets
+
+
+def join_pages(pages: List[str]) -> Tuple[str, bytes]:
+    """
+    Join per-page text into a single string and build its page index.
+
+    Args:
+        pages (List[str]): The text of each page, in order. Empty pages are kept
+            so that page numbers line up with the PDF.
+
+    Returns:
+        Tuple[str, bytes]: The joined text and the encoded page offsets.
+    """
+    return append_pages("", None, pages, separator="")
+
+
+def append_pages(text: str, blob: Optional[bytes], pages: List[str], separator: str = UPDATE_SEPARATOR) -> Tuple[str, bytes]:
+    """
+    Append pages to an already indexed document text.
+
+    Args:
+        text (str): The existing document text.
+        blob (Optional[bytes]): The existing page index, or None for an empty document.
+        pages (List[str]): The text of each new page.
+        separator (str): Inserted between the existing text and the new pages.
+
+    Returns:
+        Tuple[str, bytes]: The combined text and the encoded page offsets.
+    """
+    offsets = load_page_offsets(blob) if blob else array(OFFSET_TYPECODE)
+    parts = [text]
+    position = len(text)
+    if text and pages:
+        parts.append(separator)
+        position += len(separator)
+    for index, page_text in enumerate(pages):
+        if index:
+            parts.append(PAGE_SEPARATOR)
+            position += len(PAGE_SEPARATOR)
+        offsets.append(position)
+        parts.append(page_text)
+        position += len(page_text)
+        offsets.append(position)
+    return "".join(parts), _to_bytes(offsets)
+
+
+def page_count(blob: Optional[bytes]) -> int:
+    """Return the number of pages recorded in a page index."""
+    if not blob:
+        return 0
+    return len(blob) // (2 * array(OFFSET_TYPECODE).itemsize)
+
+
+def get_pages(text: str, blob: bytes, first: int, last: int) -> List[Tuple[int, str]]:
+    """
+    Return the text of an inclusive, 1-based page range.
+
+    Args:
+        text (str): The document text.
+        blob (bytes): The document page index.
+        first (int): The first page to return.
+        last (int): The last page to return.
+
+    Returns:
+        List[Tuple[int, str]]: ``(page_number, page_text)`` pairs.
+    """
+    offsets = load_page_offsets(blob)
+    last = min(last, len(offsets) // 2)
+    return [
+        (number, text[offsets[2 * number - 2]:offsets[2 * number - 1]])
+        for number in range(max(first, 1), last + 1)
+    ]
+
+
+def format_pages(pages: List[Tuple[int, str]]) -> str:
+    """Render pages as LLM context with a ``[Page N]`` marker before each page."""
+    return "\n\n".join(f"[Page {number}]\n{page_text}" for number, page_text in pages)
+
+
+def parse_page_range(spec: str) -> Tuple[int, Optional[int]]:
+    """
+    Parse a page range such as ``"3"``, ``"3-7"`` or ``"3-"``.
+
+    Args:
+        spec (str): The page range specification.
+
+    Returns:
+        Tuple[int, Optional[int]]: The first and last page; last is None for open ranges.
+
+    Raises:
+        ValueError: If the specification is malformed or the range is empty.
+    """
+    start, dash, end = spec.strip().partition("-")
+    try:
+        first = int(start)
+        last = (int(end) if end.strip() else None) if dash else first
+    except ValueError:
+        raise ValueError(f"Invalid page range '{spec}'. Use N, N-M or N-.")
+    if first < 1 or (last is not None and last < first):
+        raise ValueError(f"Invalid page range '{spec}'. Pages start at 1 and the range must not be empty.")
+    return first, last
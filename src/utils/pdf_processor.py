@@ -1,5 +1,68 @@
-from pypdf import PdfReader
+import time
+from loguru import logger
+from typing import List, Tuple
+from src.utils.metrics import PDF_PAGE_EXTRACTION_DURATION, PDF_PAGES_EXTRACTED
+from src.utils.lazy_import import lazy_import
+from src.utils.profiling import span
 
+pypdf = lazy_import("pypdf")
+
+
+def extract_pages_timed(pdf_path: str) -> Tuple[List[str], List[float]]:
+    """
+    Extracts the text of every page of a PDF file and times each page, without recording metrics.
+
+    Used in the ingest worker processes, whose metrics never reach /metrics;
+    the timings are returned to the server process to be recorded there.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+
+    Returns:
+        Tuple[List[str], List[float]]: The text of each page, as returned by
+        ``extract_pages_from_pdf``, and the seconds each page took.
+    """
+    with span("pdf: extract pages"):
+        pages = []
+        seconds = []
+        try:
+            reader = pypdf.PdfReader(pdf_path)
+            for page in reader.pages:
+                started = time.perf_counter()
+                pages.append(page.extract_text() or "")
+                seconds.append(time.perf_counter() - started)
+            return pages, seconds
+
+        except FileNotFoundError:
+            logger.error(f"PDF not found at {pdf_path}")
+            return [], seconds
+        except Exception:
+            logger.exception(f"Text extraction failed for {pdf_path}")
+            return [], seconds
+
+def record_page_timings(seconds: List[float]):
+    """Record the extraction metrics of pages timed by ``extract_pages_timed``."""
+    for page_seconds in seconds:
+        PDF_PAGE_EXTRACTION_DURATION.observe(page_seconds)
+    PDF_PAGES_EXTRACTED.inc(len(seconds))
+
+def extract_pages_from_pdf(pdf_path: str) -> List[str]:
+    """
+    Extracts the text of every page of a PDF file.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+
+    Returns:
+        List[str]: The extracted text of each page, in page order. Pages without
+        text are returned as empty strings so page numbers stay aligned.
+
+    Raises:
+        Exception: If there is an error processing the PDF file.
+    """
+    pages, seconds = extract_pages_timed(pdf_path)
+    record_page_timings(seconds)
+    return pages
 
 def extract_text_from_pdf(pdf_path: str) -> str:
     """
@@ -14,20 +77,4 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     Raises:
         Exception: If there is an error processing the PDF file.
     """
-    try:
-        reader = PdfReader(pdf_path)
-        full_text = []
-
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                full_text.append(text)
-
-        return "\n".join(full_text)
-
-    except FileNotFoundError:
-        print(f"Error: File not found at {pdf_path}")
-        return ""
-    except Exception as e:
-        print(f"An error occurred while extracting text from PDF: {str(e)}")
-        return ""
+    return "\n".join(text for text in extract_pages_from_pdf(pdf_path) if text)
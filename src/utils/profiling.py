@@ -0,0 +1,271 @@
+import hmac
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from datetime import datetime, UTC
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+# Requests carrying this header with the admin token are always profiled
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_ADMIN_TOKEN = os.environ.get("PROFILE_ADMIN_TOKEN")
+# Fraction of requests profiled at random, 0 disables sampling
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+# Without either, the profiling middleware is not even installed
+PROFILING_ENABLED = bool(PROFILE_ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+MAX_STACK_DEPTH = 128
+
+_NULL_SPAN = nullcontext()
+
+
+class RequestProfile:
+    """
+    Wall-clock stack samples and timed spans collected for a single request.
+
+    Only threads that are inside a span of this request are sampled, because
+    worker threads are shared with other requests.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self._lock = threading.Lock()
+        self._active_threads: Dict[int, int] = {}
+        # thread id -> [(timestamp, stack)] with stacks ordered root first
+        self.samples: Dict[int, List[Tuple[float, Tuple[Tuple[str, str, int], ...]]]] = {}
+        # thread id -> [(name, start, end)]
+        self.spans: Dict[int, List[Tuple[str, float, float]]] = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{name}", daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self.finished = time.perf_counter()
+        self._stop.set()
+        self._sampler.join()
+
+    def enter_thread(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._active_threads[ident] = self._active_threads.get(ident, 0) + 1
+
+    def exit_thread(self):
+        ident = threading.get_ident()
+        with self._lock:
+            depth = self._active_threads[ident] - 1
+            if depth:
+                self._active_threads[ident] = depth
+            else:
+                del self._active_threads[ident]
+
+    def record_span(self, name: str, start: float, end: float):
+        with self._lock:
+            self.spans.setdefault(threading.get_ident(), []).append((name, start, end))
+
+    def _sample_loop(self):
+        while not self._stop.wait(PROFILE_INTERVAL):
+            now = time.perf_counter()
+            with self._lock:
+                idents = list(self._active_threads)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples.setdefault(ident, []).append((now, tuple(stack)))
+
+    def breakdown(self) -> Dict[str, float]:
+        """Total seconds spent per span name."""
+        totals: Dict[str, float] = {}
+        for spans in self.spans.values():
+            for name, start, end in spans:
+                totals[name] = totals.get(name, 0.0) + end - start
+        return totals
+
+    def to_speedscope(self) -> dict:
+        """Render the profile in the speedscope file format (https://www.speedscope.app)."""
+        frames: List[dict] = []
+        frame_index: Dict[Tuple, int] = {}
+
+        def index_of(key: Tuple, **frame) -> int:
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append(frame)
+            return frame_index[key]
+
+        end_value = (self.finished or time.perf_counter()) - self.started
+        profiles = []
+        for ident, samples in self.samples.items():
+            stacks = []
+            for name, filename, line in (frame for _, stack in samples for frame in stack):
+                index_of((name, filename, line), name=name, file=filename, line=line)
+            for _, stack in samples:
+                stacks.append([frame_index[frame] for frame in stack])
+            profiles.append({
+                "type": "sampled",
+                "name": f"samples thread {ident}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": end_value,
+                "samples": stacks,
+                "weights": [PROFILE_INTERVAL] * len(stacks),
+            })
+        for ident, spans in self.spans.items():
+            events = []
+            for name, start, end in spans:
+                frame = index_of(("span", name), name=name)
+                events.append((start - self.started, 1, {"type": "O", "frame": frame}))
+                events.append((end - self.started, 0, {"type": "C", "frame": frame}))
+            # Close events sort before open events at the same instant so spans stay nested
+            events.sort(key=lambda item: (item[0], item[1]))
+            profiles.append({
+                "type": "evented",
+                "name": f"spans thread {ident}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": end_value,
+                "events": [dict(payload, at=at) for at, _, payload in events],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "cag-request-profiler",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def save(self, directory: str = PROFILE_DIR) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.name}.speedscope.json")
+        with open(path, "w") as f:
+            json.dump(self.to_speedscope(), f)
+        return path
+
+
+_active_profile: ContextVar[Optional[RequestProfile]] = ContextVar("active_profile", default=None)
+
+
+class _Span:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile: RequestProfile, name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.enter_thread()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profile.record_span(self.name, self.start, time.perf_counter())
+        self.profile.exit_thread()
+        return False
+
+
+def span(name: str):
+    """
+    Time a block of code as a named span of the current request's profile.
+
+    Returns a shared no-op context manager when the request is not profiled.
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return _NULL_SPAN
+    return _Span(profile, name)
+
+
+def profiled(name: str):
+    """Decorator form of :func:`span` for synchronous functions."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class ProfiledRoute(APIRoute):
+    """API route whose endpoint runs inside an ``endpoint: <name>`` span."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = profiled(f"endpoint: {endpoint.__name__}")(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def is_admin_request(headers) -> bool:
+    """Whether a request carries the admin token, compared in constant time."""
+    token = headers.get(PROFILE_HEADER)
+    if not PROFILE_ADMIN_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
+
+
+def is_sampled() -> bool:
+    """Whether a request is picked for profiling at random."""
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def start_profile(name: str) -> RequestProfile:
+    """Start profiling the current request."""
+    profile = RequestProfile(name)
+    _active_profile.set(profile)
+    profile.start()
+    return profile
+
+
+def profile_name(method: str, route: str) -> str:
+    slug = "".join(ch if ch.isalnum() else "_" for ch in route).strip("_")
+    return f"{datetime.now(UTC):%Y%m%dT%H%M%S%f}-{method}-{slug}"
+
+
+def instrument_engine(engine):
+    """Record every SQL statement executed on ``engine`` as a span of profiled requests."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _active_profile.get()
+        if profile is not None:
+            profile.enter_thread()
+            conn.info.setdefault("profile_span_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _active_profile.get()
+        if profile is not None:
+            operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+            profile.record_span(f"db: {operation}", conn.info["profile_span_start"].pop(), time.perf_counter())
+            profile.exit_thread()
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        profile = _active_profile.get()
+        starts = context.connection.info.get("profile_span_start") if context.connection is not None else None
+        if profile is not None and starts:
+            profile.record_span("db: error", starts.pop(), time.perf_counter())
+            profile.exit_thread()
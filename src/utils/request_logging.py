@@ -0,0 +1,165 @@
+import json
+import os
+import random
+import re
+import sys
+import traceback
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from loguru import logger
+
+from src.utils.metrics import route_template
+
+LOG_FILE = os.environ.get("LOG_FILE", "logs/app.log")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Comma-separated "<path prefix>=<rate>" pairs, e.g. "/api/v1/list_uuids=0.1,/metrics=0".
+# Records below WARNING of unsampled requests are dropped.
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "/metrics=0")
+# Requests slower than this are always logged, whatever their sampling rate
+LOG_SLOW_REQUEST_MS = float(os.environ.get("LOG_SLOW_REQUEST_MS", "2000"))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_ID_REGEX = re.compile(r"^[A-Za-z0-9._\-]{1,128}$")
+STDERR_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[request_id]} | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+WARNING_LEVEL = 30
+# Keys of the request context that are copied into every record
+CONTEXT_FIELDS = ("request_id", "method", "route", "user_id", "sampled")
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        prefix, _, rate = item.rpartition("=")
+        rates[prefix] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(LOG_SAMPLE_RATES)
+
+# One mutable dict per request, shared with the worker threads serving it
+_request_context: ContextVar[Optional[dict]] = ContextVar("request_log_context", default=None)
+
+
+def sample_rate(path: str) -> float:
+    """The sampling rate of the longest matching path prefix, 1.0 if none matches."""
+    matches = [prefix for prefix in SAMPLE_RATES if path.startswith(prefix)]
+    return SAMPLE_RATES[max(matches, key=len)] if matches else 1.0
+
+
+def start_request_context(scope, request_id: Optional[str] = None) -> dict:
+    """
+    Start the log context of a request.
+
+    Args:
+        scope: The ASGI scope of the request.
+        request_id (Optional[str]): A client-supplied request ID, used if well-formed.
+
+    Returns:
+        dict: The context, which is attached to every record logged while handling the request.
+    """
+    if not request_id or not REQUEST_ID_REGEX.match(request_id):
+        request_id = uuid.uuid4().hex
+    context = {
+        "request_id": request_id,
+        "method": scope.get("method"),
+        "route": None,
+        "user_id": None,
+        "sampled": random.random() < sample_rate(scope.get("path", "")),
+        "scope": scope,
+    }
+    _request_context.set(context)
+    return context
+
+
+def set_request_user(user_id: int):
+    """Attach the authenticated user to the current request's log records."""
+    context = _request_context.get()
+    if context is not None:
+        context["user_id"] = user_id
+
+
+def _patch_record(record):
+    """Copy the request context into a record. Runs on the calling thread for every record, so it is kept cheap."""
+    context = _request_context.get()
+    extra = record["extra"]
+    if context is None:
+        extra.setdefault("request_id", "-")
+        return
+    if context["route"] is None and context["scope"].get("route") is not None:
+        context["route"] = route_template(context["scope"])
+    for key in CONTEXT_FIELDS:
+        extra.setdefault(key, context[key])
+
+
+def _should_write(record) -> bool:
+    extra = record["extra"]
+    return extra.get("sampled", True) or extra.get("always", False) or record["level"].no >= WARNING_LEVEL
+
+
+def _json_format(record) -> str:
+    """Render a record as one JSON line."""
+    payload = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "message": record["message"],
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+    }
+    payload.update((key, value) for key, value in record["extra"].items() if key not in ("sampled", "always", "json"))
+    if record["exception"] is not None:
+        exc_type, exc_value, exc_traceback = record["exception"]
+        payload["exception"] = "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+    record["extra"]["json"] = json.dumps(payload, default=str)
+    return "{extra[json]}\n"
+
+
+def configure_logging() -> list:
+    """
+    Replace the default loguru handler with enqueued sinks.
+
+    Records are formatted on the calling thread but written by loguru's
+    background worker, so request threads never wait on log I/O. The file
+    sink writes one JSON object per line.
+
+    Returns:
+        list: The ids of the added handlers.
+    """
+    logger.remove()
+    logger.configure(patcher=_patch_record)
+    return [
+        logger.add(sys.stderr, level=LOG_LEVEL, format=STDERR_FORMAT, filter=_should_write, enqueue=True),
+        logger.add(
+            LOG_FILE,
+            level=LOG_LEVEL,
+            format=_json_format,
+            filter=_should_write,
+            enqueue=True,
+            rotation="1 week",
+            retention="4 weeks",
+        ),
+    ]
+
+
+def log_request_completed(status_code: int, duration: float, db_queries: int, db_seconds: float):
+    """Write the summary record of the current request, always for errors and slow requests."""
+    context = _request_context.get()
+    if context is None:
+        return
+    duration_ms = round(duration * 1000, 2)
+    level = "ERROR" if status_code >= 500 else "INFO"
+    # Resolved here rather than by the patcher, which runs after the message is built.
+    # Raw paths carry UUIDs, so they are never logged.
+    context["route"] = route_template(context["scope"])
+    logger.bind(
+        status=status_code,
+        duration_ms=duration_ms,
+        db_queries=db_queries,
+        db_ms=round(db_seconds * 1000, 2),
+        always=duration_ms >= LOG_SLOW_REQUEST_MS,
+    ).log(level, f"{context['method']} {context['route']} {status_code} in {duration_ms}ms")
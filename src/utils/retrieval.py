@@ -0,0 +1,220 @@
+import math
+import multiprocessing
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.utils.page_index import get_pages, page_count
+
+PASSAGE_CHARS = 1500
+# Tokenizing is CPU-bound pure Python, so the passages of large multi-document
+# queries are counted in worker processes rather than threads
+RETRIEVAL_WORKERS = int(os.environ.get("RETRIEVAL_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Below this many characters, sending the passages to a worker costs more than counting them inline
+PARALLEL_COUNT_MIN_CHARS = 200_000
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by do does for from has have how i in is it its of on or "
+    "that the their there these this to was were what when where which who why will with "
+    "about all any can compare say says tell than them they we you your".split()
+)
+
+
+@dataclass
+class Passage:
+    document_uuid: str
+    filename: str
+    page: Optional[int]
+    text: str
+    score: float = 0.0
+    # Frequencies of the query terms and number of tokens, see count_terms
+    term_counts: Dict[str, int] = field(default_factory=dict, repr=False)
+    length: int = 0
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords."""
+    return [token for token in TOKEN_REGEX.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _chunk(text: str, max_chars: int) -> List[str]:
+    """Split text into chunks of at most ``max_chars``, preferring paragraph and line breaks."""
+    chunks = []
+    while len(text) > max_chars:
+        cut = text.rfind("\n", 0, max_chars)
+        if cut < max_chars // 2:
+            cut = text.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text.strip():
+        chunks.append(text)
+    return chunks
+
+
+def split_passages(document_uuid: str, filename: str, text: str, page_offsets: Optional[bytes], max_chars: int = PASSAGE_CHARS) -> List[Passage]:
+    """
+    Split a document into passages, keeping page numbers when a page index exists.
+
+    Args:
+        document_uuid (str): The document UUID.
+        filename (str): The document filename.
+        text (str): The document text.
+        page_offsets (Optional[bytes]): The document page index, if any.
+        max_chars (int): Maximum passage length.
+
+    Returns:
+        List[Passage]: The passages, in document order.
+    """
+    if page_offsets:
+        pages = get_pages(text, page_offsets, 1, page_count(page_offsets))
+    else:
+        pages = [(None, text)]
+    return [
+        Passage(document_uuid, filename, number, chunk)
+        for number, page_text in pages
+        for chunk in _chunk(page_text, max_chars)
+    ]
+
+
+def query_terms(query: str) -> Set[str]:
+    """Distinct tokens of a query."""
+    return set(tokenize(query))
+
+
+def _count_texts(texts: List[str], terms: Set[str]) -> List[Tuple[int, Dict[str, int]]]:
+    """Token count and query term frequencies of each text. Runs inline or in a retrieval worker process."""
+    counted = []
+    for text in texts:
+        counts = Counter(tokenize(text))
+        counted.append((sum(counts.values()), {term: counts[term] for term in terms if term in counts}))
+    return counted
+
+
+def _apply_counts(passages: List[Passage], counted: List[Tuple[int, Dict[str, int]]]):
+    for passage, (length, term_counts) in zip(passages, counted):
+        passage.length = length
+        passage.term_counts = term_counts
+
+
+@lru_cache(maxsize=1)
+def retrieval_executor() -> ProcessPoolExecutor:
+    """The process pool shared by multi-document queries, started on first use."""
+    # Forking a process that runs server threads is unsafe, so workers are spawned
+    return ProcessPoolExecutor(max_workers=RETRIEVAL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def count_terms(per_document: List[List[Passage]], terms: Set[str]):
+    """
+    Tokenize the passages of several documents and record their length and query term frequencies.
+
+    This is the expensive part of ranking, so large requests are spread over
+    the retrieval worker processes, one task per document, while the scores
+    are computed over all documents together by ``rank_passages``.
+    """
+    total_chars = sum(len(passage.text) for passages in per_document for passage in passages)
+    if RETRIEVAL_WORKERS > 1 and len(per_document) > 1 and total_chars >= PARALLEL_COUNT_MIN_CHARS:
+        try:
+            futures = [
+                retrieval_executor().submit(_count_texts, [passage.text for passage in passages], terms)
+                for passages in per_document
+            ]
+            for passages, future in zip(per_document, futures):
+                _apply_counts(passages, future.result())
+            return
+        except BrokenProcessPool:
+            # A worker died; the pool is replaced for the next request and this one is counted inline
+            retrieval_executor.cache_clear()
+    for passages in per_document:
+        _apply_counts(passages, _count_texts([passage.text for passage in passages], terms))
+
+
+def rank_passages(per_document: List[List[Passage]], terms: Set[str], limit: int) -> List[List[Passage]]:
+    """
+    Score the passages of several documents against a query with BM25 and return the best ones of each.
+
+    Document frequencies and the average passage length are taken over the
+    passages of all documents, so that scores are comparable across documents
+    whatever their size.
+
+    Args:
+        per_document (List[List[Passage]]): The passages of each document, with their terms counted.
+        terms (Set[str]): The query terms.
+        limit (int): Maximum number of passages to return per document.
+
+    Returns:
+        List[List[Passage]]: For each document, its passages with a positive score, best first.
+        A document without any is represented by its first passage, so that it is still part of the context.
+    """
+    passages = [passage for passages in per_document for passage in passages]
+    if not passages or not terms:
+        return [passages[:1] for passages in per_document]
+    k1, b = 1.2, 0.75
+    average_length = sum(passage.length for passage in passages) / len(passages) or 1
+    idf = {}
+    for term in terms:
+        frequency = sum(1 for passage in passages if term in passage.term_counts)
+        idf[term] = math.log(1 + (len(passages) - frequency + 0.5) / (frequency + 0.5))
+    for passage in passages:
+        passage.score = sum(
+            idf[term] * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * passage.length / average_length))
+            for term, frequency in passage.term_counts.items()
+        )
+    ranked = []
+    for passages in per_document:
+        best = sorted((passage for passage in passages if passage.score > 0), key=lambda passage: passage.score, reverse=True)
+        ranked.append(best[:limit] or passages[:1])
+    return ranked
+
+
+def merge_passages(per_document: List[List[Passage]], budget_chars: int) -> List[Passage]:
+    """
+    Merge ranked passages of several documents under one character budget.
+
+    The best passage of every document is taken first so that each document is
+    represented, then the remaining budget is filled by score. If not even the
+    best passage fits, it is cut to the budget rather than leaving the context empty.
+
+    Args:
+        per_document (List[List[Passage]]): Ranked passages of each document.
+        budget_chars (int): Maximum total passage length.
+
+    Returns:
+        List[Passage]: The selected passages, grouped by document and in page order.
+    """
+    selected: List[Passage] = []
+    used = 0
+    leaders = sorted((passages[0] for passages in per_document if passages), key=lambda passage: passage.score, reverse=True)
+    rest = sorted(
+        (passage for passages in per_document for passage in passages[1:]),
+        key=lambda passage: passage.score,
+        reverse=True,
+    )
+    for passage in leaders + rest:
+        if used + len(passage.text) > budget_chars:
+            if not selected and budget_chars > 0:
+                selected.append(replace(passage, text=passage.text[:budget_chars]))
+                used = budget_chars
+            continue
+        selected.append(passage)
+        used += len(passage.text)
+    order = {passages[0].document_uuid: index for index, passages in enumerate(per_document) if passages}
+    selected.sort(key=lambda passage: (order[passage.document_uuid], passage.page or 0))
+    return selected
+
+
+def format_passages(passages: List[Passage]) -> str:
+    """Render passages as LLM context, labelled with their document and page."""
+    blocks = []
+    for passage in passages:
+        label = f'[Document {passage.document_uuid} "{passage.filename}"'
+        if passage.page is not None:
+            label += f", Page {passage.page}"
+        blocks.append(f"{label}]\n{passage.text}")
+    return "\n\n".join(blocks)
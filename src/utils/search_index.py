@@ -0,0 +1,382 @@
+import html
+import re
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from loguru import logger
+from sqlalchemy import BigInteger, Column, Index, Integer, MetaData, String, Table, Text, inspect, select, text
+from sqlalchemy.orm import Session
+
+from src.models import ChatMessage, Conversation
+
+SEARCH_TABLE = "chat_search"
+SNIPPET_TOKENS = 12
+HIGHLIGHT_START, HIGHLIGHT_END = "<mark>", "</mark>"
+# Private-use characters marking matches until the snippet text is HTML-escaped
+MATCH_START, MATCH_END = "\ue000", "\ue001"
+TOKEN_REGEX = re.compile(r"\w+", re.UNICODE)
+
+# MySQL keeps the index in a regular table with a FULLTEXT index. SQLite uses an
+# FTS5 virtual table of the same name, created with raw DDL in init_search_index.
+# Both have an owner column holding an indexed token per user, so that a search
+# only walks the postings of the user's own entries.
+FTS5_COLUMNS = "body, owner, kind UNINDEXED, conversation_id UNINDEXED, message_id UNINDEXED"
+FTS5_DDL = f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5({FTS5_COLUMNS}, tokenize='unicode61 remove_diacritics 2')"
+
+mysql_metadata = MetaData()
+mysql_search_table = Table(
+    SEARCH_TABLE,
+    mysql_metadata,
+    Column("rowid", BigInteger, primary_key=True, autoincrement=False),
+    Column("user_id", Integer, nullable=False, index=True),
+    Column("conversation_id", Integer, nullable=False, index=True),
+    Column("message_id", Integer, nullable=True),
+    Column("kind", String(16), nullable=False),
+    Column("owner", String(32), nullable=False),
+    Column("body", Text, nullable=False),
+    Index("ix_chat_search_owner_body", "owner", "body", mysql_prefix="FULLTEXT"),
+)
+
+
+@dataclass
+class SearchHit:
+    conversation_uuid: str
+    conversation_title: str
+    kind: str  # 'message' or 'title'
+    role: Optional[str]
+    snippet: str
+    timestamp: Optional[datetime]
+    score: float
+
+
+def _message_rowid(message_id: int) -> int:
+    return message_id * 2
+
+
+def _title_rowid(conversation_id: int) -> int:
+    return conversation_id * 2 + 1
+
+
+def _owner_token(user_id: int) -> str:
+    return f"u{user_id}"
+
+
+def _mysql_owner_token(user_id: int) -> str:
+    # InnoDB does not index words shorter than innodb_ft_min_token_size (3)
+    return f"owner{user_id}"
+
+
+def _is_sqlite(db_or_engine) -> bool:
+    bind = db_or_engine.get_bind() if isinstance(db_or_engine, Session) else db_or_engine
+    return bind.dialect.name == "sqlite"
+
+
+def init_search_index(engine):
+    """Create the full-text index table for the engine's dialect if it does not exist."""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            existing = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": SEARCH_TABLE}
+            ).scalar()
+            if existing is not None and FTS5_COLUMNS not in existing:
+                # Indexes created before the owner column kept the user id UNINDEXED; copy them over
+                logger.info(f"Migrating search index {SEARCH_TABLE} to an indexed owner column")
+                conn.execute(text(f"ALTER TABLE {SEARCH_TABLE} RENAME TO {SEARCH_TABLE}_old"))
+                conn.execute(text(FTS5_DDL))
+                conn.execute(text(
+                    f"INSERT INTO {SEARCH_TABLE} (rowid, body, owner, kind, conversation_id, message_id) "
+                    f"SELECT rowid, body, 'u' || user_id, kind, conversation_id, message_id FROM {SEARCH_TABLE}_old"
+                ))
+                conn.execute(text(f"DROP TABLE {SEARCH_TABLE}_old"))
+            else:
+                conn.execute(text(FTS5_DDL))
+    else:
+        inspector = inspect(engine)
+        if inspector.has_table(SEARCH_TABLE) and "owner" not in {
+            column["name"] for column in inspector.get_columns(SEARCH_TABLE)
+        }:
+            # Indexes created before the owner column filtered on user_id after the full-text match
+            logger.info(f"Migrating search index {SEARCH_TABLE} to an indexed owner column")
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {SEARCH_TABLE} ADD COLUMN owner VARCHAR(32) NOT NULL DEFAULT ''"))
+                conn.execute(text(f"UPDATE {SEARCH_TABLE} SET owner = CONCAT('owner', user_id)"))
+                conn.execute(text(f"ALTER TABLE {SEARCH_TABLE} DROP INDEX ix_chat_search_body"))
+                conn.execute(text(f"ALTER TABLE {SEARCH_TABLE} ADD FULLTEXT INDEX ix_chat_search_owner_body (owner, body)"))
+        mysql_metadata.create_all(bind=engine)
+
+
+def _upsert(db: Session, rows: List[dict]):
+    if not rows:
+        return
+    if _is_sqlite(db):
+        db.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"), [{"rowid": row["rowid"]} for row in rows])
+        db.execute(
+            text(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, body, owner, kind, conversation_id, message_id) "
+                "VALUES (:rowid, :body, :owner, :kind, :conversation_id, :message_id)"
+            ),
+            [{**row, "owner": _owner_token(row["user_id"])} for row in rows],
+        )
+    else:
+        db.execute(mysql_search_table.delete().where(mysql_search_table.c.rowid.in_([row["rowid"] for row in rows])))
+        db.execute(mysql_search_table.insert(), [{**row, "owner": _mysql_owner_token(row["user_id"])} for row in rows])
+
+
+def index_messages(db: Session, user_id: int, messages: Iterable[ChatMessage]):
+    """
+    Add chat messages to the search index in the caller's transaction.
+
+    The messages must already be flushed so that they have ids.
+    """
+    _upsert(db, [
+        {
+            "rowid": _message_rowid(message.id),
+            "body": message.content,
+            "kind": "message",
+            "user_id": user_id,
+            "conversation_id": message.conversation_id,
+            "message_id": message.id,
+        }
+        for message in messages
+    ])
+
+
+def index_title(db: Session, user_id: int, conversation_id: int, title: str):
+    """Add or replace a conversation title in the search index in the caller's transaction."""
+    _upsert(db, [{
+        "rowid": _title_rowid(conversation_id),
+        "body": title,
+        "kind": "title",
+        "user_id": user_id,
+        "conversation_id": conversation_id,
+        "message_id": None,
+    }])
+
+
+def _delete_rowids(db: Session, rowids: List[int]):
+    if not rowids:
+        return
+    if _is_sqlite(db):
+        db.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"), [{"rowid": rowid} for rowid in rowids])
+    else:
+        db.execute(mysql_search_table.delete().where(mysql_search_table.c.rowid.in_(rowids)))
+
+
+def remove_messages(db: Session, message_ids: List[int]):
+    """Remove the index entries of the given messages."""
+    _delete_rowids(db, [_message_rowid(message_id) for message_id in message_ids])
+
+
+def remove_titles(db: Session, conversation_ids: List[int]):
+    """Remove the title entries of the given conversations."""
+    _delete_rowids(db, [_title_rowid(conversation_id) for conversation_id in conversation_ids])
+
+
+def remove_conversations(db: Session, conversation_ids: List[int]):
+    """Remove every index entry of the given conversations."""
+    if not conversation_ids:
+        return
+    if _is_sqlite(db):
+        # conversation_id is not indexed in FTS5, so go through the message ids instead
+        message_ids = [
+            message_id for (message_id,) in
+            db.query(ChatMessage.id).filter(ChatMessage.conversation_id.in_(conversation_ids))
+        ]
+        remove_messages(db, message_ids)
+        remove_titles(db, conversation_ids)
+    else:
+        db.execute(mysql_search_table.delete().where(mysql_search_table.c.conversation_id.in_(conversation_ids)))
+
+
+def optimize_search_index(engine):
+    """Merge the index segments left behind by many deletes (SQLite FTS5 only; InnoDB does this itself)."""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"))
+
+
+def _fts5_query(query: str, user_id: int) -> str:
+    """
+    Turn free text into an FTS5 query that ANDs the quoted terms, prefix-matching
+    the last one, within the entries of one user.
+    """
+    terms = TOKEN_REGEX.findall(query)
+    if not terms:
+        return ""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return f'owner : "{_owner_token(user_id)}" AND body : ({" ".join(quoted)})'
+
+
+def _mysql_boolean_query(query: str, user_id: int) -> str:
+    """Turn free text into a boolean-mode query requiring the user's owner token and any of the terms."""
+    terms = TOKEN_REGEX.findall(query)
+    if not terms:
+        return ""
+    return f"+{_mysql_owner_token(user_id)} +({' '.join(terms)})"
+
+
+def _escape_snippet(snippet: str) -> str:
+    """HTML-escape a snippet, then turn its match markers into highlight tags."""
+    return html.escape(snippet).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+def _highlight(body: str, query: str) -> str:
+    """Build a snippet around the first matching term, for backends without a snippet function."""
+    terms = [term.lower() for term in TOKEN_REGEX.findall(query)]
+    words = body.split()
+    hit = next((index for index, word in enumerate(words) if any(term in word.lower() for term in terms)), 0)
+    start = max(0, hit - SNIPPET_TOKENS // 2)
+    window = words[start:start + SNIPPET_TOKENS]
+    marked = [
+        f"{MATCH_START}{word}{MATCH_END}" if any(term in word.lower() for term in terms) else word
+        for word in window
+    ]
+    prefix = "…" if start else ""
+    suffix = "…" if start + SNIPPET_TOKENS < len(words) else ""
+    return prefix + " ".join(marked) + suffix
+
+
+def search(db: Session, user_id: int, query: str, limit: int, offset: int) -> List[SearchHit]:
+    """
+    Search a user's active conversations, best matches first.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): Only conversations of this user are searched.
+        query (str): Free-text query.
+        limit (int): Maximum number of hits.
+        offset (int): Number of hits to skip.
+
+    Returns:
+        List[SearchHit]: The ranked hits.
+    """
+    if _is_sqlite(db):
+        match = _fts5_query(query, user_id)
+        if not match:
+            return []
+        # The owner column only filters, so it is given no weight in the ranking
+        rows = db.execute(
+            text(
+                f"SELECT s.kind, s.conversation_id, s.message_id, bm25({SEARCH_TABLE}, 1.0, 0.0) AS score, "
+                f"snippet({SEARCH_TABLE}, 0, :start, :end, '…', :tokens) AS snippet "
+                f"FROM {SEARCH_TABLE} AS s JOIN conversations AS c ON c.id = s.conversation_id "
+                f"WHERE {SEARCH_TABLE} MATCH :match AND c.is_active = 1 "
+                "ORDER BY score LIMIT :limit OFFSET :offset"
+            ),
+            {
+                "match": match, "limit": limit, "offset": offset,
+                "start": MATCH_START, "end": MATCH_END, "tokens": SNIPPET_TOKENS,
+            },
+        ).all()
+        # bm25() is lower-is-better; expose a higher-is-better score
+        hits = [(row.kind, row.conversation_id, row.message_id, -row.score, row.snippet) for row in rows]
+    else:
+        against = _mysql_boolean_query(query, user_id)
+        if not against:
+            return []
+        table = mysql_search_table
+        conversations_table = Conversation.__table__
+        # The owner token is part of the full-text match, so only the user's own postings are read
+        relevance = text("MATCH (chat_search.owner, chat_search.body) AGAINST (:against IN BOOLEAN MODE)").bindparams(
+            against=against
+        )
+        rows = db.execute(
+            select(table.c.kind, table.c.conversation_id, table.c.message_id, table.c.body, relevance.label("score"))
+            .select_from(table.join(conversations_table, conversations_table.c.id == table.c.conversation_id))
+            .where(relevance, table.c.user_id == user_id, conversations_table.c.is_active.is_(True))
+            .order_by(text("score DESC"))
+            .limit(limit)
+            .offset(offset)
+        ).all()
+        hits = [(row.kind, row.conversation_id, row.message_id, float(row.score), _highlight(row.body, query)) for row in rows]
+
+    conversation_ids = {hit[1] for hit in hits}
+    message_ids = {hit[2] for hit in hits if hit[2] is not None}
+    conversations = {
+        row.id: row for row in
+        db.query(Conversation.id, Conversation.uuid, Conversation.title).filter(Conversation.id.in_(conversation_ids))
+    } if conversation_ids else {}
+    messages = {
+        row.id: row for row in
+        db.query(ChatMessage.id, ChatMessage.role, ChatMessage.timestamp).filter(ChatMessage.id.in_(message_ids))
+    } if message_ids else {}
+
+    results = []
+    for kind, conversation_id, message_id, score, snippet in hits:
+        conversation = conversations.get(conversation_id)
+        if conversation is None:
+            continue
+        message = messages.get(message_id)
+        results.append(SearchHit(
+            conversation_uuid=conversation.uuid,
+            conversation_title=conversation.title,
+            kind=kind,
+            role=message.role if message else None,
+            # Message text is escaped so that clients can render the highlights as HTML
+            snippet=_escape_snippet(snippet),
+            timestamp=message.timestamp if message else None,
+            score=round(score, 4),
+        ))
+    return results
+
+
+def rebuild_search_index(db: Session, batch_size: int = 1000) -> int:
+    """
+    Index every existing conversation title and message, for databases created
+    before the search index existed. Safe to run repeatedly.
+
+    Returns:
+        int: The number of indexed entries.
+    """
+    total = 0
+    last_id = 0
+    while True:
+        conversations = (
+            db.query(Conversation.id, Conversation.user_id, Conversation.title)
+            .filter(Conversation.id > last_id).order_by(Conversation.id).limit(batch_size).all()
+        )
+        if not conversations:
+            break
+        for conversation in conversations:
+            index_title(db, conversation.user_id, conversation.id, conversation.title)
+        db.commit()
+        total += len(conversations)
+        last_id = conversations[-1].id
+
+    last_id = 0
+    while True:
+        rows = (
+            db.query(ChatMessage, Conversation.user_id)
+            .join(Conversation, Conversation.id == ChatMessage.conversation_id)
+            .filter(ChatMessage.id > last_id).order_by(ChatMessage.id).limit(batch_size).all()
+        )
+        if not rows:
+            break
+        by_user = {}
+        for message, user_id in rows:
+            by_user.setdefault(user_id, []).append(message)
+        for user_id, messages in by_user.items():
+            index_messages(db, user_id, messages)
+        last_id = rows[-1][0].id
+        db.commit()
+        db.expunge_all()
+        total += len(rows)
+        logger.info(f"Search index rebuild: {total} entries indexed")
+    return total
+
+
+if __name__ == "__main__":
+    # python -m src.utils.search_index rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("Usage: python -m src.utils.search_index rebuild")
+    from src.db import SessionLocal, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        print(f"Indexed {rebuild_search_index(session)} entries.")
+    finally:
+        session.close()
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+# The app reads its database URL when first imported, so the throwaway
+# database and upload directory are set up before any test module imports it
+WORKDIR = tempfile.mkdtemp(prefix="cag-tests-")
+os.environ["MYSQL_DATABASE_URL"] = f"sqlite:///{WORKDIR}/test.db"
+os.environ["GEMINI_API_KEY"] = "test-fake-key"
+os.environ["DOTENV_PATH"] = os.path.join(WORKDIR, ".env")
+os.chdir(WORKDIR)
+sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from benchmarks import fake_llm
+
+    fake_llm.install(fake_llm.FakeLLMConfig(first_chunk_latency=0, chunk_interval=0, chunks=2))
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def auth_headers(client):
+    import uuid
+
+    credentials = {"username": f"test-{uuid.uuid4().hex[:8]}", "password": "test-password"}
+    client.post("/api/v1/auth/register", json=credentials).raise_for_status()
+    response = client.post("/api/v1/auth/login", json=credentials)
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def document_uuid(client, auth_headers):
+    import uuid
+
+    from benchmarks.synthetic_pdf import generate_pdf
+
+    document_uuid = str(uuid.uuid4())
+    response = client.post(
+        f"/api/v1/upload/{document_uuid}",
+        files={"file": ("test.pdf", generate_pdf(3, seed=1), "application/pdf")},
+        headers=auth_headers,
+    )
+    assert response.status_code == 201, response.text
+    return document_uuid
@@ -0,0 +1,41 @@
+import pytest
+
+from src.utils import admission
+
+
+@pytest.fixture
+def rate_limited(monkeypatch):
+    controller = admission.AdmissionController(rate_per_minute=1, burst=3)
+    monkeypatch.setattr(admission, "controller", controller)
+    return controller
+
+
+def test_summarize_returns_429_when_rate_limited(client, auth_headers, document_uuid, rate_limited):
+    statuses = [client.post(f"/api/v1/summarize/{document_uuid}", headers=auth_headers).status_code for _ in range(3)]
+    assert statuses == [200, 200, 200]
+
+    response = client.post(f"/api/v1/summarize/{document_uuid}", headers=auth_headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_batch_takes_one_token_per_llm_call(client, auth_headers, document_uuid, rate_limited):
+    batch = {"questions": ["What is it about?", "Who wrote it?", "When?"], "questions_per_call": 1}
+    response = client.post(f"/api/v1/query/{document_uuid}/batch", json=batch, headers=auth_headers)
+    assert response.status_code == 200
+    assert all(result["error"] is None for result in response.json()["results"])
+
+    for path in (f"/api/v1/query/{document_uuid}/batch", f"/api/v1/summarize/{document_uuid}"):
+        response = client.post(path, json=batch, headers=auth_headers)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_batch_larger_than_burst_is_rejected(client, auth_headers, document_uuid, rate_limited):
+    batch = {"questions": ["One?", "Two?", "Three?", "Four?"], "questions_per_call": 1}
+    response = client.post(f"/api/v1/query/{document_uuid}/batch", json=batch, headers=auth_headers)
+    assert response.status_code == 400
+
+    batch["questions_per_call"] = 2
+    response = client.post(f"/api/v1/query/{document_uuid}/batch", json=batch, headers=auth_headers)
+    assert response.status_code == 200
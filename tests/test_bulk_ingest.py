@@ -0,0 +1,16 @@
+from prometheus_client import REGISTRY
+
+from benchmarks.synthetic_pdf import generate_pdf
+
+
+def pages_extracted() -> float:
+    return REGISTRY.get_sample_value("pdf_pages_extracted_total") or 0.0
+
+
+def test_bulk_upload_records_extraction_metrics_in_the_server_process(client, auth_headers):
+    before = pages_extracted()
+    files = [("files", (f"doc-{index}.pdf", generate_pdf(4, seed=index), "application/pdf")) for index in range(2)]
+    response = client.post("/api/v1/bulk/upload", files=files, headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["created"] == 2
+    assert pages_extracted() - before == 8
@@ -0,0 +1,52 @@
+import base64
+import gzip
+import json
+
+from src.utils import data_transfer
+
+
+def export_lines(client, auth_headers):
+    response = client.get("/api/v1/export", headers=auth_headers)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.content.splitlines()]
+
+
+def import_lines(client, auth_headers, lines, compress=False):
+    payload = b"".join(json.dumps(line).encode() + b"\n" for line in lines)
+    if compress:
+        payload = gzip.compress(payload)
+    return client.post("/api/v1/import", files={"file": ("export.ndjson", payload)}, headers=auth_headers)
+
+
+def test_import_round_trip_skips_existing_records(client, auth_headers, document_uuid):
+    lines = export_lines(client, auth_headers)
+    response = import_lines(client, auth_headers, lines, compress=True)
+    assert response.status_code == 200
+    assert response.json()["documents"] == {"imported": 0, "skipped": 1, "renamed": 0}
+
+
+def test_import_rejects_invalid_pdf(client, auth_headers, document_uuid):
+    header, document = export_lines(client, auth_headers)[:2]
+    document["uuid"] = "00000000-0000-4000-8000-000000000001"
+    document["pdf"] = base64.b64encode(b"<html><script>alert(1)</script></html>").decode()
+    response = import_lines(client, auth_headers, [header, document])
+    assert response.status_code == 400
+    assert "Invalid or corrupted PDF" in response.json()["detail"]
+
+
+def test_import_rejects_long_lines(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(data_transfer, "MAX_IMPORT_LINE_BYTES", 1024)
+    header = {"type": "header", "version": data_transfer.EXPORT_FORMAT_VERSION}
+    message = {"type": "message", "conversation_uuid": "x", "role": "user", "content": "a" * 2048}
+    response = import_lines(client, auth_headers, [header, message], compress=True)
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Line 2 is longer than")
+
+
+def test_import_rejects_large_exports(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(data_transfer, "MAX_IMPORT_BYTES", 1024)
+    header = {"type": "header", "version": data_transfer.EXPORT_FORMAT_VERSION}
+    messages = [{"type": "message", "conversation_uuid": "x", "role": "user", "content": "a" * 100}] * 20
+    response = import_lines(client, auth_headers, [header, *messages], compress=True)
+    assert response.status_code == 400
+    assert "once decompressed" in response.json()["detail"]
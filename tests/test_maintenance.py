@@ -0,0 +1,9 @@
+from src.utils import maintenance
+
+
+def test_maintenance_passes_never_overlap(client):
+    with maintenance.maintenance_lock() as acquired:
+        assert acquired
+        assert maintenance.run_maintenance(dry_run=True) == {"skipped": {"reason": "another maintenance pass is running"}}
+    report = maintenance.run_maintenance(dry_run=True)
+    assert set(report) == {"conversations", "files"}
@@ -0,0 +1,7 @@
+from src.utils.model_routing import SUMMARY, parse_policy
+
+
+def test_summaries_use_the_standard_tier_unless_the_prompt_is_too_long():
+    policy = parse_policy({})
+    assert [tier.name for tier in policy.route(SUMMARY, 400_000)] == ["standard", "long_context"]
+    assert [tier.name for tier in policy.route(SUMMARY, 4_000_000)] == ["long_context"]
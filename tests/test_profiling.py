@@ -0,0 +1,29 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.utils import profiling
+
+
+def test_profiling_middleware_is_not_installed_when_off(client):
+    import main
+
+    assert not profiling.PROFILING_ENABLED
+    assert main.profile_request not in [middleware.kwargs.get("dispatch") for middleware in main.app.user_middleware]
+
+
+def test_profile_path_is_only_returned_to_admins(monkeypatch):
+    import main
+
+    monkeypatch.setattr(profiling, "PROFILE_ADMIN_TOKEN", "secret-token")
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1.0)
+    app = FastAPI()
+    app.middleware("http")(main.profile_request)
+    app.get("/ping")(lambda: {"ok": True})
+
+    with TestClient(app) as test_client:
+        sampled = test_client.get("/ping")
+        wrong_token = test_client.get("/ping", headers={profiling.PROFILE_HEADER: "secret-tokex"})
+        admin = test_client.get("/ping", headers={profiling.PROFILE_HEADER: "secret-token"})
+    assert "X-Profile-Path" not in sampled.headers
+    assert "X-Profile-Path" not in wrong_token.headers
+    assert admin.headers["X-Profile-Path"].endswith(".speedscope.json")
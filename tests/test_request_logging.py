@@ -0,0 +1,15 @@
+from loguru import logger
+
+
+def test_request_summary_uses_the_route_template(client, auth_headers, document_uuid):
+    messages = []
+    handler = logger.add(lambda message: messages.append(message.record), level="INFO")
+    try:
+        response = client.get(f"/api/v1/pages/{document_uuid}", headers=auth_headers)
+    finally:
+        logger.remove(handler)
+    assert response.status_code == 200
+    summaries = [record for record in messages if "status" in record["extra"]]
+    assert [record["message"].rsplit(" in ", 1)[0] for record in summaries] == ["GET /api/v1/pages/{uuid} 200"]
+    assert summaries[0]["extra"]["route"] == "/api/v1/pages/{uuid}"
+    assert all(document_uuid not in record["message"] for record in messages)
@@ -0,0 +1,56 @@
+from src.utils import retrieval
+from src.utils.retrieval import Passage, count_terms, query_terms, rank_passages
+
+TEXTS = [
+    "The payment terms are net thirty days. Late payment incurs interest.",
+    "Termination requires ninety days written notice by either party.",
+    "Liability is limited to the fees paid in the preceding twelve months.",
+]
+
+
+def passages():
+    return [[Passage(f"doc-{index}", "doc.pdf", 1, text)] for index, text in enumerate(TEXTS)]
+
+
+def test_count_terms_in_worker_processes_matches_inline(monkeypatch):
+    terms = query_terms("What are the payment terms and termination notice?")
+    inline = passages()
+    count_terms(inline, terms)
+
+    monkeypatch.setattr(retrieval, "RETRIEVAL_WORKERS", 2)
+    monkeypatch.setattr(retrieval, "PARALLEL_COUNT_MIN_CHARS", 0)
+    parallel = passages()
+    count_terms(parallel, terms)
+
+    assert [(p.length, p.term_counts) for ps in parallel for p in ps] == [(p.length, p.term_counts) for ps in inline for p in ps]
+    assert inline[0][0].term_counts == {"payment": 2, "terms": 1}
+
+
+def test_rank_passages_keeps_every_document():
+    per_document = passages()
+    terms = query_terms("payment terms")
+    count_terms(per_document, terms)
+    ranked = rank_passages(per_document, terms, 8)
+    assert [len(ranked_passages) for ranked_passages in ranked] == [1, 1, 1]
+    assert ranked[0][0].score > 0 and ranked[1][0].score == 0
+
+
+def test_multi_document_query(client, auth_headers, document_uuid):
+    response = client.post("/api/v1/query/multi", json={"query": "What does it say?"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert [document["uuid"] for document in response.json()["documents"]] == [document_uuid]
+    assert response.json()["documents"][0]["context_pages"]
+
+
+def test_merge_passages_cuts_a_passage_larger_than_the_budget():
+    per_document = [[Passage("doc-0", "doc.pdf", 1, "x" * 1500, score=1.0)], [Passage("doc-1", "doc.pdf", 1, "y" * 1500)]]
+    merged = retrieval.merge_passages(per_document, 1000)
+    assert [passage.text for passage in merged] == ["x" * 1000]
+    assert len(per_document[0][0].text) == 1500
+
+
+def test_multi_document_query_rejects_a_budget_below_one_passage(client, auth_headers):
+    response = client.post(
+        "/api/v1/query/multi", json={"query": "What does it say?", "max_context_chars": 1000}, headers=auth_headers
+    )
+    assert response.status_code == 422
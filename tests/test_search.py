@@ -0,0 +1,20 @@
+from src.utils.search_index import _escape_snippet, _highlight
+
+
+def test_search_snippets_escape_message_html(client, auth_headers, document_uuid):
+    message = '<img src=x onerror="alert(1)"> what are the zanzibar terms?'
+    response = client.post(f"/api/v1/chat/start/{document_uuid}", json={"message": message}, headers=auth_headers)
+    assert response.status_code == 200, response.text
+
+    response = client.get("/api/v1/chat/search", params={"q": "zanzibar"}, headers=auth_headers)
+    assert response.status_code == 200
+    snippets = [result["snippet"] for result in response.json()["results"] if result["kind"] == "message"]
+    assert snippets
+    assert "<img" not in snippets[0]
+    assert "&lt;img" in snippets[0]
+    assert "<mark>zanzibar</mark>" in snippets[0]
+
+
+def test_highlight_escapes_message_html():
+    snippet = _escape_snippet(_highlight("<b>bold</b> payment & terms", "payment"))
+    assert snippet == "&lt;b&gt;bold&lt;/b&gt; <mark>payment</mark> &amp; terms"